@@ -1,14 +1,12 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
 import pandas as pd
 from datetime import datetime, timezone
 import os
 from dotenv import load_dotenv
-import time
-import random
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
 from googleapiclient.errors import HttpError
+from firestore_writer import get_existing_ids, commit_in_batches
+from sheets_client import execute
+import clients
+from clients import get_firebase_app, get_firestore_client, SHEETS_READONLY_SCOPES
 
 # Load environment variables from .env file (for Firebase and Sheets credentials)
 load_dotenv()
@@ -18,46 +16,16 @@ load_dotenv()
 # ---------------------------
 def initialize_firebase():
     try:
-        if not firebase_admin._apps:  # Prevent re-initialization
-            firebase_creds = {
-                "type": "service_account",
-                "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-                "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-                "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace("\\n", "\n"),
-                "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-                "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-                "token_uri": "https://oauth2.googleapis.com/token"
-            }
-            cred = credentials.Certificate(firebase_creds)
-            firebase_admin.initialize_app(cred)
-            print("✅ Firebase initialized successfully.")
-        else:
-            print("✅ Firebase already initialized.")
+        get_firebase_app()
     except Exception as e:
         print(f"❌ Error initializing Firebase: {e}")
 
-def get_firestore_client():
-    return firestore.client()
-
 # ---------------------------
-# Google Sheets API Initialization using env variables
+# Google Sheets API (read-only, cached per thread)
 # ---------------------------
 def get_sheets_service():
     try:
-        sheets_creds = {
-            "type": "service_account",
-            "project_id": os.getenv("GSPREAD_PROJECT_ID"),
-            "private_key_id": os.getenv("GSPREAD_PRIVATE_KEY_ID"),
-            "private_key": os.getenv("GSPREAD_PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("GSPREAD_CLIENT_EMAIL"),
-            "client_id": os.getenv("GSPREAD_CLIENT_ID"),
-            "token_uri": "https://oauth2.googleapis.com/token"
-        }
-        credentials_ = Credentials.from_service_account_info(
-            sheets_creds,
-            scopes=["https://www.googleapis.com/auth/spreadsheets.readonly"]
-        )
-        service = build("sheets", "v4", credentials=credentials_)
+        service = clients.get_sheets_service(SHEETS_READONLY_SCOPES)
         print("✅ Google Sheets API initialized successfully.")
         return service
     except Exception as e:
@@ -65,47 +33,27 @@ def get_sheets_service():
         return None
 
 # ---------------------------
-# Function to fetch Google Sheets data with retry logic
+# Function to fetch Google Sheets data (quota-aware, with retries)
 # ---------------------------
-def fetch_sheet_data(sheet_service, spreadsheet_id, range_name, max_retries=5, initial_delay=1):
-    retries = 0
-    delay = initial_delay
-    
-    while retries < max_retries:
-        try:
-            result = sheet_service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name).execute()
-            return result
-        except HttpError as err:
-            if err.resp.status == 429:  # Too Many Requests
-                retries += 1
-                wait_time = delay * (2 ** retries) + random.uniform(0, 1)  # Exponential backoff with some randomness
-                print(f"Rate limit exceeded. Retrying in {wait_time:.2f} seconds... (Attempt {retries}/{max_retries})")
-                time.sleep(wait_time)
-            else:
-                print(f"HTTP error occurred: {err}")
-                break
-    print(f"Failed to fetch data after {max_retries} retries.")
-    return None
+def fetch_sheet_data(sheet_service, spreadsheet_id, range_name):
+    try:
+        return execute(sheet_service.spreadsheets().values().get(spreadsheetId=spreadsheet_id, range=range_name))
+    except HttpError as err:
+        print(f"HTTP error occurred: {err}")
+        return None
 
 # ---------------------------
-# Utility: Convert date string to Unix timestamp
+# Utility: Convert a column of date strings to Unix timestamps
 # ---------------------------
-def convert_date_to_unix(date_str):
+def convert_dates_to_unix(date_strings):
     """
-    Converts a date from format 'DD/Mon/YYYY' to a Unix timestamp in seconds
-    using the current UTC time.
+    Converts a Series of dates in format 'DD/Mon/YYYY' to Unix timestamps in seconds
+    using the current UTC time of day. Invalid or empty dates become NaN.
     """
-    try:
-        if not date_str or pd.isna(date_str):
-            return None
-        date_str = str(date_str).strip()
-        date_obj = datetime.strptime(date_str, "%d/%b/%Y")
-        current_time = datetime.now(timezone.utc).time()
-        date_time_obj = datetime.combine(date_obj, current_time).replace(tzinfo=timezone.utc)
-        return int(date_time_obj.timestamp())
-    except ValueError:
-        print(f"Invalid date format: {date_str}")
-        return None
+    dates = pd.to_datetime(date_strings.astype("string").str.strip(), format="%d/%b/%Y", errors="coerce")
+    now = datetime.now(timezone.utc)
+    time_of_day = pd.Timedelta(hours=now.hour, minutes=now.minute, seconds=now.second)
+    return ((dates + time_of_day) - pd.Timestamp("1970-01-01")) // pd.Timedelta(seconds=1)
 
 # ---------------------------
 # Main function: Batch update Firestore with data from Google Sheet
@@ -124,7 +72,7 @@ def main():
     spreadsheet_id = "14rr4IiEfMVQ_GlzZ-90EkeVNuo4uk_HjjGf8104a3JI"
     range_name = "Sheet77!A:C"
     
-    # Fetch data from Google Sheet with retry logic
+    # Fetch data from Google Sheet (retried on quota and server errors)
     result = fetch_sheet_data(sheets_service, spreadsheet_id, range_name)
     
     if not result:
@@ -145,51 +93,42 @@ def main():
 
     # Get Firestore collection name from env or use default "ACN123"
     collection_name = os.getenv("FIRESTORE_COLLECTION", "ACN123")
+    collection_ref = db.collection(collection_name)
     
-    # Retrieve existing document IDs from Firestore
-    existing_ids = set()
-    for doc in db.collection(collection_name).stream():
-        existing_ids.add(doc.id)
-    print(f"Found {len(existing_ids)} existing documents in collection '{collection_name}'.")
-    
-    # Create a batch to perform multiple updates at once
-    batch = db.batch()
-    batch_count = 0
-    batch_limit = 500  # Firestore batch limit
-    
-    # Process each row from the Google Sheet
-    for _, row in dataframe.iterrows():
-        property_id = row["propertyId"]  # Field name in Google Sheet
-        date_str = row["dateOfStatusLastChecked"]  # Field name in Google Sheet
-        # Default status is "Available" if not provided
-        status = row["status"] if pd.notna(row["status"]) and str(row["status"]).strip() else "Available"
-        timestamp = convert_date_to_unix(date_str)
-
-        if timestamp:
-            if property_id in existing_ids:
-                doc_ref = db.collection(collection_name).document(property_id)
-                batch.update(doc_ref, {
-                    "dateOfStatusLastChecked": timestamp,
-                    "status": status
-                })
-                batch_count += 1
-                # Commit batch when limit is reached
-                if batch_count == batch_limit:
-                    batch.commit()
-                    print(f"Committed a batch of {batch_count} updates.")
-                    batch = db.batch()
-                    batch_count = 0
-            else:
-                print(f"Skipping update for {property_id} as it does not exist in Firestore.")
-        else:
-            print(f"Skipping update for {property_id} due to invalid date.")
-
-    # Commit any remaining updates in the batch
-    if batch_count > 0:
-        batch.commit()
-        print(f"Committed the final batch of {batch_count} updates.")
-
-    print("Update process completed.")
+    # Parse every date and default every status in one pass over the columns
+    timestamps = convert_dates_to_unix(dataframe["dateOfStatusLastChecked"])
+    raw_status = dataframe["status"].astype("string")
+    statuses = raw_status.where(raw_status.str.strip().fillna("") != "", "Available")
+
+    invalid = timestamps.isna()
+    if invalid.any():
+        print(f"Skipping {int(invalid.sum())} rows due to invalid date:")
+        print(dataframe.loc[invalid, ["propertyId", "dateOfStatusLastChecked"]].to_string(index=False))
+
+    property_ids = dataframe.loc[~invalid, "propertyId"].to_numpy()
+    timestamps = timestamps[~invalid].astype("int64").to_numpy()
+    statuses = statuses[~invalid].to_numpy()
+
+    # Check existence only for the property IDs present in the sheet
+    existing_ids = get_existing_ids(db, collection_ref, property_ids.tolist())
+    print(f"Found {len(existing_ids)} of the sheet's properties in collection '{collection_name}'.")
+
+    exists = pd.Series(property_ids).isin(existing_ids).to_numpy()
+    if not exists.all():
+        missing = property_ids[~exists]
+        print(f"Skipping {len(missing)} rows as they do not exist in Firestore: {', '.join(map(str, missing))}")
+
+    # Updates are committed in 500-op batches, several at a time
+    operations = [
+        ("update", collection_ref.document(property_id), {
+            "dateOfStatusLastChecked": int(timestamp),
+            "status": str(status)
+        })
+        for property_id, timestamp, status in zip(property_ids[exists], timestamps[exists], statuses[exists])
+    ]
+
+    committed, failed = commit_in_batches(db, operations)
+    print(f"Update process completed. Committed {committed} updates, {failed} failed.")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,133 @@
+import os
+import datetime
+import pytz
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from firebase_admin import firestore
+from firestore_writer import commit_in_batches
+
+# ---------------------------
+# Plan and credit writes for agents, shared by the dashboard and its tests
+# ---------------------------
+# Plan changes run in a transaction so trial tracking sees the agent as it is at
+# commit time; credit changes are server-side increments, so concurrent writers
+# never overwrite each other.
+
+PLAN_CONFIGS = {
+    "premium": {
+        "expiry_days": 365,
+        "monthly_credits": 100,
+        "user_type": "premium"
+    },
+    "trial": {
+        "expiry_days": 30,
+        "monthly_credits": 100,
+        "user_type": "trial"
+    },
+    "basic": {
+        "expiry_days": 30,
+        "monthly_credits": 5,
+        "user_type": "basic"
+    }
+}
+
+# Plan changes run one transaction per agent, this many at a time
+BULK_PLAN_WORKERS = int(os.getenv("BULK_PLAN_WORKERS", "8"))
+
+def build_plan_update(plan, agent_data):
+    """Return (update_data, plan_expiry) for moving an agent to `plan`"""
+    config = PLAN_CONFIGS[plan]
+    current_date = datetime.datetime.now(pytz.timezone('Asia/Kolkata'))
+    current_timestamp = int(current_date.timestamp())
+
+    # Calculate dates
+    next_renewal = current_date + datetime.timedelta(days=30)
+    plan_expiry = current_date + datetime.timedelta(days=config["expiry_days"])
+
+    # Prepare update data
+    update_data = {
+        'nextRenewal': int(next_renewal.timestamp()),
+        'userType': config["user_type"],
+        'planExpiry': int(plan_expiry.timestamp()),
+        'monthlyCredits': config["monthly_credits"],
+        'updatedAt': current_timestamp,
+        'lastModified': current_timestamp
+    }
+
+    # Handle trial usage tracking
+    previous_plan = agent_data.get('userType', None)
+    if previous_plan == "basic" and plan != "basic":
+        update_data['trialUsed'] = True
+        update_data['trialStartedAt'] = current_timestamp
+
+    return update_data, plan_expiry
+
+@firestore.transactional
+def apply_plan_in_transaction(transaction, agent_ref, plan):
+    """Read the agent inside the transaction so trial tracking sees the current plan"""
+    snapshot = agent_ref.get(transaction=transaction)
+    update_data, plan_expiry = build_plan_update(plan, snapshot.to_dict() or {})
+    transaction.update(agent_ref, update_data)
+    return plan_expiry
+
+def update_plan(db, agent_id, plan):
+    """Move one agent to `plan`; retried automatically if another write lands first. Returns the new expiry"""
+    agent_ref = db.collection('agents').document(agent_id)
+    return apply_plan_in_transaction(db.transaction(), agent_ref, plan)
+
+def build_credit_update(credits_to_add):
+    """Server-side increment, so concurrent writers never overwrite each other"""
+    current_timestamp = int(datetime.datetime.now(pytz.timezone('Asia/Kolkata')).timestamp())
+    return {
+        'monthlyCredits': firestore.Increment(credits_to_add),
+        'updatedAt': current_timestamp,
+        'lastModified': current_timestamp
+    }
+
+def add_credits(db, agent_id, credits_to_add):
+    """Add (or, when negative, remove) credits on one agent"""
+    db.collection('agents').document(agent_id).update(build_credit_update(credits_to_add))
+
+def build_bulk_changes(agents, plan=None, credits_delta=0):
+    """Return [(agent_data, update_data)] for the bulk action (a preview; plan changes are recomputed on apply)"""
+    changes = []
+    for agent_data in agents.values():
+        if plan:
+            update_data, _ = build_plan_update(plan, agent_data)
+        else:
+            update_data = build_credit_update(credits_delta)
+        changes.append((agent_data, update_data))
+    return changes
+
+def apply_bulk_plan(db, changes, plan, on_progress=None):
+    """
+    Move every agent to `plan`, each in its own transaction, so the update is built
+    from the agent as it is now rather than as it was when the preview was made.
+    """
+    committed, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=BULK_PLAN_WORKERS) as executor:
+        futures = {
+            executor.submit(update_plan, db, agent_data['id'], plan): agent_data
+            for agent_data, _ in changes
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+                committed += 1
+            except Exception as e:
+                failed += 1
+                print(f"❌ Plan change for agent {futures[future]['id']} failed: {e}")
+            if on_progress:
+                on_progress(committed, failed)
+    return committed, failed
+
+def apply_bulk_changes(db, changes, plan=None, on_progress=None):
+    """Apply the bulk action; returns (committed, failed)"""
+    if plan:
+        return apply_bulk_plan(db, changes, plan, on_progress=on_progress)
+    # Credit changes are server-side increments: concurrent writers can't overwrite each
+    # other, but a batch retried after an ambiguous failure would add the credits twice
+    operations = [
+        ("update", db.collection('agents').document(agent_data['id']), update_data)
+        for agent_data, update_data in changes
+    ]
+    return commit_in_batches(db, operations, on_progress=on_progress, idempotent=False)
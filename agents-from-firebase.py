@@ -1,37 +1,35 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-import gspread
-from google.oauth2.service_account import Credentials
 from datetime import datetime, timezone
 import json
 import os
 from dotenv import load_dotenv
 import sys
 import codecs
-
-# Ensure UTF-8 output (fixes UnicodeEncodeError on Windows)
-sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+from snapshot_cache import read_through
+from sheets_writer import write_sheet_diff
+from clients import get_firebase_app, get_firestore_client, get_sheets_service
+from firestore_watcher import watch_collection
+from parquet_export import parquet_requested, export_collection
 
 # Load environment variables from .env file
 load_dotenv()
 
+# Stores the raw lastModified high-water mark used by `--incremental` runs
+SYNC_STATE_FILE = os.getenv("AGENTS_SYNC_STATE_FILE", "agents-sync-state.json")
+
+# Define the fixed column order
+FIXED_COLUMNS = [
+    "phonenumber", "cpId", "name", "extraDetails", "verified", "businessName",
+    "myInventories", "areaOfOperation", "firmSize", "firmName", "lastModified",
+    "notes", "blacklisted", "gstNo", "dailyCredits", "added", "admin", "kam",
+    "reraId", "monthlyCredits", "userType", "trialUsed", "trialEnd","nextRenewal","onboardingComplete","expiry","trialUsed","trialStartedAt","areaOfOperation"
+]
+
+# Unix-second fields stored as timestamps in the Parquet export
+TIMESTAMP_FIELDS = ["added", "lastModified", "planExpiry", "nextRenewal", "trialStartedAt"]
+
 def initialize_firebase():
     try:
-        if not firebase_admin._apps:  # Prevent re-initialization
-            firebase_creds = {
-                "type": "service_account",
-                "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-                "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-                "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace("\\n", "\n"),
-                "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-                "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-                "token_uri": "https://oauth2.googleapis.com/token"
-            }
-            cred = credentials.Certificate(firebase_creds)
-            firebase_admin.initialize_app(cred)
-            print("✅ Firebase initialized successfully.")
-        else:
-            print("✅ Firebase already initialized.")
+        get_firebase_app()
     except Exception as e:
         print(f"❌ Error initializing Firebase: {e}")
 
@@ -57,127 +55,218 @@ def flatten_field(value):
         return ", ".join(str(v) for v in value)
     return value
 
-def fetch_firestore_data(collection_name):
+def max_modified(high_water_mark, raw_modified):
+    """Larger of the current high-water mark and a raw numeric lastModified."""
+    if isinstance(raw_modified, (int, float)) and not isinstance(raw_modified, bool):
+        if high_water_mark is None or raw_modified > high_water_mark:
+            return raw_modified
+    return high_water_mark
+
+def format_agent(item):
+    """Turn one agent document into a sheet row dict (dates formatted, lists flattened)."""
+    # Clean and convert existing fields
+    item["phonenumber"] = clean_phone_number(item.get("phonenumber", ""))
+    item["added"] = convert_unix_to_date(item.get("added"))
+    item["lastModified"] = convert_unix_to_date(item.get("lastModified"))
+
+    # New: compute trialEnd based on planExpiry & userType
+    plan_expiry = item.get("planExpiry")
+    if item.get("userType") in ("trial", "premium") and plan_expiry:
+        item["trialEnd"] = convert_unix_to_date(plan_expiry)
+    else:
+        item["expiry"] = convert_unix_to_date(plan_expiry)
+
+    # New: compute nextRenewal based on planExpiry
+    if next_renewal := item.get("nextRenewal"):
+        item["nextRenewal"] = convert_unix_to_date(next_renewal)
+    else:
+        item["nextRenewal"] = ""
+
+    if "trialUsed" in item and item["trialUsed"]:
+        item["trialStartedAt"] = convert_unix_to_date(item.get("trialStartedAt", ""))
+
+    # Flatten list fields if needed
+    return {k: flatten_field(v) for k, v in item.items()}
+
+def fetch_firestore_data(collection_name, since=None):
+    """
+    Fetch and format agent documents. When `since` is given, only documents whose
+    raw `lastModified` is at or after it are read: several agents can share the
+    boundary value, so the documents at the mark are read again (and deduped by ID)
+    rather than skipped. Returns (rows, high_water_mark), where high_water_mark is
+    the largest raw `lastModified` seen.
+    """
     try:
-        db = firestore.client()
+        db = get_firestore_client()
         collection_ref = db.collection(collection_name)
-        print(f"🔍 Fetching data from Firestore collection: {collection_name}...")
-        docs = list(collection_ref.stream())
-        if not docs:
-            print("⚠️ No documents found in Firestore.")
-            return []
+        if since is not None:
+            print(f"🔍 Fetching documents modified since {since} from Firestore collection: {collection_name}...")
+            docs = collection_ref.where("lastModified", ">=", since).stream()
+        else:
+            print(f"🔍 Fetching data from Firestore collection: {collection_name}...")
+            docs = read_through(collection_ref)
         
-        rows = []
+        rows = {}
+        high_water_mark = since
         for doc in docs:
+            if doc.id in rows:
+                continue
             try:
                 item = doc.to_dict()
                 if not isinstance(item, dict):
                     print(f"⚠️ Unexpected data format in document {doc.id}: {item}")
                     continue
 
-                # Clean and convert existing fields
-                item["phonenumber"] = clean_phone_number(item.get("phonenumber", ""))
-                item["added"] = convert_unix_to_date(item.get("added"))
-                item["lastModified"] = convert_unix_to_date(item.get("lastModified"))
-
-                # New: compute trialEnd based on planExpiry & userType
-                plan_expiry = item.get("planExpiry")
-                if item.get("userType") in ("trial", "premium") and plan_expiry:
-                    item["trialEnd"] = convert_unix_to_date(plan_expiry)
-                else:
-                    item["expiry"] = convert_unix_to_date(plan_expiry)
-
-                # New: compute nextRenewal based on planExpiry
-                if next_renewal := item.get("nextRenewal"):
-                    item["nextRenewal"] = convert_unix_to_date(next_renewal)
-                else:
-                    item["nextRenewal"] = ""
-
-                if "trialUsed" in item and item["trialUsed"]:
-                    item["trialStartedAt"] = convert_unix_to_date(item.get("trialStartedAt", ""))
-
-                # Flatten list fields if needed
-                processed = {k: flatten_field(v) for k, v in item.items()}
-                rows.append(processed)
+                # Track the raw lastModified before it is turned into a date string
+                high_water_mark = max_modified(high_water_mark, item.get("lastModified"))
+                rows[doc.id] = format_agent(item)
 
             except Exception as doc_error:
                 print(f"⚠️ Error processing document {doc.id}: {doc_error}")
 
+        if not rows:
+            print("⚠️ No documents found in Firestore.")
+            return [], since
+
         print(f"✅ Successfully fetched {len(rows)} records from Firestore.")
-        return rows
+        return list(rows.values()), high_water_mark
 
     except Exception as e:
         print(f"❌ Error fetching data from Firestore: {e}")
-        return []
+        return None, since
 
 def write_to_google_sheet(data, spreadsheet_id, sheet_name):
+    """Sync the sheet to `data`, sending only rows that changed (matched on cpId)."""
     try:
         if not data:
             print("⚠️ No data to write to Google Sheets.")
-            return
-        
-        sheets_creds = {
-            "type": "service_account",
-            "project_id": os.getenv("GSPREAD_PROJECT_ID"),
-            "private_key_id": os.getenv("GSPREAD_PRIVATE_KEY_ID"),
-            "private_key": os.getenv("GSPREAD_PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("GSPREAD_CLIENT_EMAIL"),
-            "client_id": os.getenv("GSPREAD_CLIENT_ID"),
-            "token_uri": "https://oauth2.googleapis.com/token"
-        }
-        
-        credentials_obj = Credentials.from_service_account_info(
-            sheets_creds,
-            scopes=['https://www.googleapis.com/auth/spreadsheets']
-        )
-        gc = gspread.authorize(credentials_obj)
-        spreadsheet = gc.open_by_key(spreadsheet_id)
-        
-        try:
-            sheet = spreadsheet.worksheet(sheet_name)
-        except gspread.exceptions.WorksheetNotFound:
-            sheet = spreadsheet.add_worksheet(title=sheet_name, rows="100", cols="50")
-            print(f"✅ New sheet '{sheet_name}' created.")
-        
-        print(f"✅ Google Sheet '{sheet_name}' opened successfully.")
-        
-        # Define the fixed column order
-        fixed_columns = [
-            "phonenumber", "cpId", "name", "extraDetails", "verified", "businessName",
-            "myInventories", "areaOfOperation", "firmSize", "firmName", "lastModified",
-            "notes", "blacklisted", "gstNo", "dailyCredits", "added", "admin", "kam",
-            "reraId", "monthlyCredits", "userType", "trialUsed", "trialEnd","nextRenewal","onboardingComplete","expiry","trialUsed","trialStartedAt","areaOfOperation"
-        ]
+            return False
         
         # Ensure all data rows follow the fixed column order
         formatted_data = [
-            [item.get(field, "") for field in fixed_columns]
+            [item.get(field, "") for field in FIXED_COLUMNS]
             for item in data
         ]
         
-        data_to_write = [fixed_columns] + formatted_data
-        sheet.clear()
-        sheet.update(values=data_to_write, range_name="A1")
+        write_sheet_diff(get_sheets_service(), spreadsheet_id, sheet_name, FIXED_COLUMNS, formatted_data, "cpId")
         print("✅ Data written successfully with a fixed column order.")
+        return True
     except Exception as e:
         print(f"❌ Error writing to Google Sheets: {e}")
+        return False
 
-def main():
+def patch_google_sheet(data, spreadsheet_id, sheet_name):
+    """
+    Update only the rows of the given agents, matched on cpId. Agents that are not
+    in the sheet yet are appended; other rows are left untouched.
+    """
+    try:
+        if not data:
+            print("✅ No changed agents, nothing to patch.")
+            return True
+
+        formatted_data = [
+            [item.get(field, "") for field in FIXED_COLUMNS]
+            for item in data
+        ]
+        write_sheet_diff(
+            get_sheets_service(), spreadsheet_id, sheet_name, FIXED_COLUMNS, formatted_data, "cpId",
+            delete_missing=False
+        )
+        return True
+    except Exception as e:
+        print(f"❌ Error patching Google Sheets: {e}")
+        return False
+
+def load_high_water_mark():
+    try:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f).get("lastModified")
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"⚠️ Could not read sync state {SYNC_STATE_FILE}: {e}")
+        return None
+
+def save_high_water_mark(value):
+    if value is None:
+        return
+    try:
+        with open(SYNC_STATE_FILE, "w", encoding="utf-8") as f:
+            json.dump({"lastModified": value}, f)
+        print(f"✅ Saved lastModified high-water mark {value}.")
+    except Exception as e:
+        print(f"⚠️ Could not save sync state {SYNC_STATE_FILE}: {e}")
+
+def watch_agents(collection_name, spreadsheet_id, sheet_name):
+    """Keep the sheet current from a realtime listener, patching changed agents by cpId."""
+    high_water_mark = load_high_water_mark()
+
+    def flush(changed, removed):
+        nonlocal high_water_mark
+        rows = []
+        for doc in changed:
+            item = doc.to_dict()
+            if isinstance(item, dict):
+                high_water_mark = max_modified(high_water_mark, item.get("lastModified"))
+                rows.append(format_agent(item))
+        if removed:
+            print(f"⚠️ {len(removed)} agents were deleted; their rows go on the next full sync.")
+        print(f"🔍 Patching {len(rows)} changed agents in Google Sheets...")
+        if not patch_google_sheet(rows, spreadsheet_id, sheet_name):
+            raise RuntimeError("patching Google Sheets failed")
+        save_high_water_mark(high_water_mark)
+
+    watch_collection(get_firestore_client().collection(collection_name), flush)
+
+def main(argv=None):
+    """Run the sync; returns True on success, False if any step failed."""
+    argv = sys.argv[1:] if argv is None else argv
     try:
         initialize_firebase()
         print("🔍 Firebase initialized, moving to Firestore fetch...")
         collection_name = "agents"
-        data = fetch_firestore_data(collection_name)
-        print("🔍 Firestore fetch completed, checking data...")
-        if data:
-            spreadsheet_id = "17_9YH7wcHHlgMmBOp50AuYR0Kx0_7-DQMoO38RBI3vg"
-            sheet_name = "Sheet1"
-            print(f"🔍 Writing {len(data)} records to Google Sheets...")
-            write_to_google_sheet(data, spreadsheet_id, sheet_name)
+        spreadsheet_id = "17_9YH7wcHHlgMmBOp50AuYR0Kx0_7-DQMoO38RBI3vg"
+        sheet_name = "Sheet1"
+
+        since = load_high_water_mark() if "--incremental" in argv else None
+        if since is not None:
+            # Incremental run: only agents modified since the last run, patched by cpId
+            data, high_water_mark = fetch_firestore_data(collection_name, since=since)
+            if data is None:
+                return False
+            print(f"🔍 Patching {len(data)} changed records in Google Sheets...")
+            ok = patch_google_sheet(data, spreadsheet_id, sheet_name)
+            if ok:
+                save_high_water_mark(high_water_mark)
         else:
-            print("⚠️ No data to write to Google Sheets.")
+            data, high_water_mark = fetch_firestore_data(collection_name)
+            if data is None:
+                return False
+            print("🔍 Firestore fetch completed, checking data...")
+            ok = True
+            if data:
+                print(f"🔍 Writing {len(data)} records to Google Sheets...")
+                ok = write_to_google_sheet(data, spreadsheet_id, sheet_name)
+                if ok:
+                    save_high_water_mark(high_water_mark)
+            else:
+                print("⚠️ No data to write to Google Sheets.")
+
+        if parquet_requested(argv):
+            path = export_collection(get_firestore_client().collection(collection_name), timestamp_fields=TIMESTAMP_FIELDS)
+            ok = ok and path is not None
+
+        if "--watch" in argv:
+            # Catch up first (above), then stream changes into the sheet; the first flush
+            # re-checks every agent, covering writes made since the (possibly cached) sync
+            watch_agents(collection_name, spreadsheet_id, sheet_name)
+        return ok
     except Exception as e:
         print(f"❌ An error occurred: {e}")
+        return False
 
 if __name__ == "__main__":
-    main()
+    # Ensure UTF-8 output (fixes UnicodeEncodeError on Windows)
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+    sys.exit(0 if main() else 1)
@@ -1,8 +1,6 @@
 import streamlit as st
-import subprocess
-import os
-import time
 import sys
+from job_runner import JobRunner
 
 # Get the Python interpreter path
 PYTHON_EXECUTABLE = sys.executable
@@ -27,24 +25,14 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-# Function to run external scripts
-def run_script(script_name):
-    path = os.path.join(os.getcwd(), script_name)
-    if not os.path.exists(path):
-        return f"⚠️ Script not found: `{script_name}`"
-    start = time.time()
-    try:
-        with st.spinner(f"⚡ Executing {script_name}"):
-            proc = subprocess.run([PYTHON_EXECUTABLE, path], capture_output=True, text=True, encoding="utf-8", env={**os.environ, "PYTHONUTF8": "1"})
-        dura = round(time.time() - start, 2)
-        out = proc.stdout.strip() or "No output received"
-        err = proc.stderr.strip() or ""
-        if proc.returncode == 0:
-            return f"✨ Success ({dura}s)\n\n```\n{out}\n```"
-        else:
-            return f"❌ Failed ({dura}s)\n\n```\n{err}\n```"
-    except Exception as e:
-        return f"💥 Error: {e}"
+# Shared job runner: one per server process, so jobs survive reruns and are visible to every operator
+@st.cache_resource
+def get_job_runner():
+    return JobRunner(python_executable=PYTHON_EXECUTABLE)
+
+runner = get_job_runner()
+
+STATUS_ICONS = {"queued": "⏳", "running": "⚡", "succeeded": "✨", "failed": "❌", "cancelled": "🛑", "skipped": "⏭️"}
 
 # UI Header
 st.markdown("""
@@ -60,7 +48,8 @@ dict_scripts = {
     "Agents": {"file": "agents-from-firebase.py", "desc": "Sync agent data from Firebase"},
     "Inventory": {"file": "inventories-from-firebase.py", "desc": "Sync inventory records from Firebase"},
     "Enquiries": {"file": "enquires-from-firebase.py", "desc": "Sync enquiries from Firebase"},
-    "Database": {"file": "Dateupdate.py", "desc": "Update Last Checked Date in Firebase"},
+    # Writes to Firebase, so it runs in its own process and can be cancelled midway
+    "Database": {"file": "Dateupdate.py", "desc": "Update Last Checked Date in Firebase", "cancellable": True},
     "Requirements": {"file": "requirements-from-firebase.py", "desc": "Sync requirements from Firebase"}
 }
 
@@ -68,9 +57,27 @@ dict_scripts = {
 st.markdown("<h2 style='text-align:center; margin-bottom:30px;'>Available Operations</h2>", unsafe_allow_html=True)
 for key, info in dict_scripts.items():
     if st.button(f"Execute {key}", key=f"btn_{key}", use_container_width=True):
-        st.session_state.output = run_script(info['file'])
+        st.session_state.selected_job = runner.submit(key, info['file'], cancellable=info.get('cancellable', False))
 
-# Output display
-if 'output' in st.session_state:
+# Live job output, refreshed every second while this page is open
+@st.fragment(run_every=1)
+def show_jobs():
+    jobs = runner.list_jobs()
+    if not jobs:
+        return
     st.markdown("<h2 style='text-align:center;'>Operation Output</h2>", unsafe_allow_html=True)
-    st.text_area("", st.session_state.output, height=300, key="output_area")
+    for job in jobs[:10]:
+        col1, col2, col3 = st.columns([4, 1, 1])
+        with col1:
+            st.markdown(f"{STATUS_ICONS[job.status]} **{job.name}** `{job.id}` — {job.status} ({job.duration}s)")
+        with col2:
+            if st.button("Show", key=f"show_{job.id}", use_container_width=True):
+                st.session_state.selected_job = job.id
+        with col3:
+            if job.cancellable and st.button("Cancel", key=f"cancel_{job.id}", use_container_width=True):
+                runner.cancel(job.id)
+
+    job = runner.get(st.session_state.get("selected_job")) or jobs[0]
+    st.text_area(f"{job.name} ({job.id})", job.output(), height=300)
+
+show_jobs()
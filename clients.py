@@ -0,0 +1,71 @@
+import os
+import threading
+import firebase_admin
+from firebase_admin import credentials, firestore
+from googleapiclient.discovery import build
+from google.oauth2.service_account import Credentials
+from dotenv import load_dotenv
+
+# ---------------------------
+# Shared, cached Google API clients
+# ---------------------------
+# Credentials are parsed once per process and keep their OAuth token until it
+# expires, the Firebase app is initialized once, and each thread builds its Sheets
+# service once (httplib2 connections are not thread-safe) and then reuses it, so
+# repeated runs skip token minting and discovery-document parsing.
+
+load_dotenv()
+
+SHEETS_SCOPES          = ("https://www.googleapis.com/auth/spreadsheets",)
+SHEETS_READONLY_SCOPES = ("https://www.googleapis.com/auth/spreadsheets.readonly",)
+TOKEN_URI              = "https://oauth2.googleapis.com/token"
+
+_lock = threading.Lock()
+_credentials = {}
+_thread_state = threading.local()
+
+def service_account_info(prefix):
+    """Service-account dict from <prefix>_PROJECT_ID, <prefix>_PRIVATE_KEY, ... env vars."""
+    return {
+        "type": "service_account",
+        "project_id": os.getenv(f"{prefix}_PROJECT_ID"),
+        "private_key_id": os.getenv(f"{prefix}_PRIVATE_KEY_ID"),
+        "private_key": os.getenv(f"{prefix}_PRIVATE_KEY", "").replace("\\n", "\n"),
+        "client_email": os.getenv(f"{prefix}_CLIENT_EMAIL"),
+        "client_id": os.getenv(f"{prefix}_CLIENT_ID"),
+        "token_uri": TOKEN_URI
+    }
+
+def get_credentials(prefix="GSPREAD", scopes=SHEETS_SCOPES):
+    """google-auth credentials for an env prefix and scopes, shared by every thread."""
+    key = (prefix, tuple(scopes))
+    with _lock:
+        if key not in _credentials:
+            _credentials[key] = Credentials.from_service_account_info(
+                service_account_info(prefix), scopes=list(scopes)
+            )
+        return _credentials[key]
+
+def get_firebase_app():
+    """Initialize the default Firebase app from FIREBASE_* env vars once per process."""
+    with _lock:
+        if not firebase_admin._apps:
+            firebase_admin.initialize_app(credentials.Certificate(service_account_info("FIREBASE")))
+            print("✅ Firebase initialized successfully.")
+        return firebase_admin.get_app()
+
+def get_firestore_client():
+    # firebase_admin keeps one client per app, so this is cheap after the first call
+    return firestore.client(get_firebase_app())
+
+def get_sheets_service(scopes=SHEETS_SCOPES):
+    """Sheets v4 service for the calling thread, built on the shared credentials."""
+    services = getattr(_thread_state, "sheets", None)
+    if services is None:
+        services = _thread_state.sheets = {}
+    key = tuple(scopes)
+    if key not in services:
+        services[key] = build(
+            "sheets", "v4", credentials=get_credentials("GSPREAD", scopes), cache_discovery=False
+        )
+    return services[key]
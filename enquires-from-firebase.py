@@ -1,17 +1,15 @@
-import firebase_admin
-from firebase_admin import credentials, firestore
-from googleapiclient.discovery import build
-from google.oauth2.service_account import Credentials
 from datetime import datetime, timezone
 import json
-import os
 from dotenv import load_dotenv
 import sys
 import codecs
 import pandas as pd
 import numpy as np
-
-sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+from snapshot_cache import read_through
+from sheets_writer import write_sheet_diff
+from clients import get_firebase_app, get_firestore_client, get_sheets_service
+from firestore_watcher import watch_collection
+from parquet_export import parquet_requested, export_collection
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,48 +17,10 @@ load_dotenv()
 # Firebase Admin SDK initialization
 def initialize_firebase():
     try:
-        if not firebase_admin._apps:  # Prevent re-initialization
-            firebase_creds = {
-                "type": "service_account",
-                "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-                "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-                "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace("\\n", "\n"),
-                "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-                "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-                "token_uri": "https://oauth2.googleapis.com/token"
-            }
-            cred = credentials.Certificate(firebase_creds)
-            firebase_admin.initialize_app(cred)
-            print("✅ Firebase initialized successfully.")
-        else:
-            print("✅ Firebase already initialized.")
+        get_firebase_app()
     except Exception as e:
         print(f"❌ Error initializing Firebase: {e}")
 
-# Firestore client
-def get_firestore_client():
-    return firestore.client()
-
-# Google Sheets API initialization
-def get_sheets_service():
-    try:
-        sheets_creds = {
-            "type": "service_account",
-            "project_id": os.getenv("GSPREAD_PROJECT_ID"),
-            "private_key_id": os.getenv("GSPREAD_PRIVATE_KEY_ID"),
-            "private_key": os.getenv("GSPREAD_PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("GSPREAD_CLIENT_EMAIL"),
-            "client_id": os.getenv("GSPREAD_CLIENT_ID"),
-            "token_uri": "https://oauth2.googleapis.com/token"
-        }
-        credentials_obj = Credentials.from_service_account_info(
-            sheets_creds, scopes=["https://www.googleapis.com/auth/spreadsheets"]
-        )
-        return build("sheets", "v4", credentials=credentials_obj)
-    except Exception as e:
-        print(f"❌ Error initializing Google Sheets API: {e}")
-        return None
-
 # Convert Unix timestamps to human-readable dates
 def convert_unix_to_date(unix_timestamp):
     try:
@@ -94,77 +54,115 @@ def flatten_value(value):
         return json.dumps(value, ensure_ascii=False)
     return value
 
+# Turn one enquiry document into a sheet row dict
+def format_enquiry(doc):
+    item = doc.to_dict()
+    item["id"] = doc.id  # Include Firestore Document ID
+    item["added"] = convert_unix_to_date(item.get("added"))
+    item["lastModified"] = convert_unix_to_date(item.get("lastModified"))
+    # Apply flatten_value to each field
+    return {k: flatten_value(v) for k, v in item.items()}
+
 # Fetch and process Firestore data with sorting
 def fetch_firestore_data(collection_name):
     try:
         db = get_firestore_client()
         collection_ref = db.collection(collection_name)
-        docs = collection_ref.stream()
+        docs = read_through(collection_ref)
         rows = []
         all_fields = set()
         
         for doc in docs:
-            item = doc.to_dict()
-            item["id"] = doc.id  # Include Firestore Document ID
-            item["added"] = convert_unix_to_date(item.get("added"))
-            item["lastModified"] = convert_unix_to_date(item.get("lastModified"))
-            # Apply flatten_value to each field
-            item = {k: flatten_value(v) for k, v in item.items()}
+            item = format_enquiry(doc)
             all_fields.update(item.keys())
             rows.append(item)
 
-        # Sort data in descending order based on 'added' column
-        rows.sort(key=lambda x: x.get("added", ""), reverse=True)
+        # Sort data in descending order based on 'added' column; the id breaks ties between
+        # enquiries added on the same day so the order (and the ordered sheet diff) is stable
+        rows.sort(key=lambda x: (x.get("added", ""), x["id"]), reverse=True)
 
         print(f"✅ Successfully fetched {len(rows)} records from Firestore (sorted by 'added').")
         return rows, sorted(all_fields)
     except Exception as e:
         print(f"❌ Error fetching data from Firestore: {e}")
-        return [], []
+        return None, []
 
 # Write data to Google Sheets
 def write_to_google_sheet(data, spreadsheet_id, sheet_name, all_fields):
     try:
         if not data:
             print("⚠️ No data to write to Google Sheets.")
-            return
+            return True
         service = get_sheets_service()
-        if not service:
-            return
         print("✅ Google Sheets API initialized successfully.")
         headers = list(all_fields)
         formatted_data = [[item.get(field, "") for field in headers] for item in data]
-        sheet_data = [headers] + formatted_data
-        service.spreadsheets().values().clear(
-            spreadsheetId=spreadsheet_id, range=sheet_name
-        ).execute()
-        service.spreadsheets().values().update(
-            spreadsheetId=spreadsheet_id,
-            range=sheet_name,
-            valueInputOption="RAW",
-            body={"values": sheet_data}
-        ).execute()
+        # Only changed rows are sent, matched on the enquiry document id; ordered keeps the
+        # newest-first order, inserting new enquiries at their place instead of at the bottom
+        write_sheet_diff(service, spreadsheet_id, sheet_name, headers, formatted_data, "id", ordered=True)
         print("✅ Data written successfully to Google Sheets.")
+        return True
     except Exception as e:
         print(f"❌ Error writing to Google Sheets: {e}")
+        return False
+
+# Keep the sheet current from a realtime listener, upserting changed enquiries by id
+def watch_enquiries(collection_name, spreadsheet_id, sheet_name, all_fields):
+    headers = list(all_fields)
+
+    def flush(changed, removed):
+        rows = [format_enquiry(doc) for doc in changed]
+        new_fields = {field for row in rows for field in row} - set(headers)
+        if new_fields:
+            print(f"⚠️ New fields {sorted(new_fields)} are skipped until the next full sync.")
+        if removed:
+            print(f"⚠️ {len(removed)} enquiries were deleted; their rows go on the next full sync.")
+        # New enquiries land at the bottom here; the next full sync puts them back in order
+        print(f"🔍 Upserting {len(rows)} changed enquiries in Google Sheets...")
+        formatted_data = [[row.get(field, "") for field in headers] for row in rows]
+        write_sheet_diff(
+            get_sheets_service(), spreadsheet_id, sheet_name, headers, formatted_data, "id",
+            delete_missing=False
+        )
+
+    watch_collection(get_firestore_client().collection(collection_name), flush)
 
 # Main function
-def main():
+def main(argv=None):
+    """Run the sync; returns True on success, False if any step failed."""
+    argv = sys.argv[1:] if argv is None else argv
     try:
         initialize_firebase()
         print("🔍 Firebase initialized, moving to Firestore fetch...")
         collection_name = "enquiries"
         data, all_fields = fetch_firestore_data(collection_name)
+        if data is None:
+            return False
         print("🔍 Firestore fetch completed, checking data...")
+        ok = True
         if data:
             spreadsheet_id = "18iYLeUxU6qc5UE7u6OjQ2ZbwSTKeikufQ70fZVa_m3c"
             sheet_name = "Sheet1"
             print(f"🔍 Writing {len(data)} records to Google Sheets...")
-            write_to_google_sheet(data, spreadsheet_id, sheet_name, all_fields)
+            ok = write_to_google_sheet(data, spreadsheet_id, sheet_name, all_fields)
+            if parquet_requested(argv):
+                path = export_collection(
+                    get_firestore_client().collection(collection_name),
+                    timestamp_fields=["added", "lastModified"]
+                )
+                ok = ok and path is not None
+            if "--watch" in argv:
+                # Full sync first (above), then stream changes into the sheet; the first flush
+                # re-checks every enquiry, covering writes made since the (possibly cached) sync
+                watch_enquiries(collection_name, spreadsheet_id, sheet_name, all_fields)
         else:
             print("⚠️ No data to write to Google Sheets.")
+        return ok
     except Exception as e:
         print(f"❌ An error occurred: {e}")
+        return False
 
 if __name__ == "__main__":
-    main()
+    # Ensure UTF-8 output (fixes UnicodeEncodeError on Windows)
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,105 @@
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------------------------
+# Parallel Firestore collection reader shared by the sync scripts
+# ---------------------------
+# A collection is split into document-ID ranges; each range is read on its own
+# thread with `order_by("__name__")` + `start_after` cursors, and pages are handed
+# back through a bounded queue so memory stays flat however large the collection is.
+# Passing `fields` adds a select() projection, so only those fields are downloaded.
+
+READ_WORKERS = int(os.getenv("FIRESTORE_READ_WORKERS", "8"))
+PAGE_SIZE    = int(os.getenv("FIRESTORE_PAGE_SIZE", "500"))
+
+# Firestore auto-generated IDs are drawn from this alphabet (sorted by byte value)
+ID_ALPHABET = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz"
+
+_DONE = object()
+
+def split_id_ranges(partitions):
+    """
+    Split the document-ID space into `partitions` (start, end) ranges. The first
+    start and last end are None (open), so every possible ID falls in exactly one range.
+    """
+    partitions = max(1, min(int(partitions), len(ID_ALPHABET)))
+    step = len(ID_ALPHABET) / partitions
+    bounds = [ID_ALPHABET[round(i * step)] for i in range(1, partitions)]
+    return list(zip([None] + bounds, bounds + [None]))
+
+def iter_range_pages(collection_ref, start=None, end=None, page_size=PAGE_SIZE, fields=None):
+    """Yield lists of snapshots for document IDs in [start, end), one page at a time."""
+    query = collection_ref.select(list(fields)) if fields else collection_ref
+    if start is not None:
+        query = query.where("__name__", ">=", collection_ref.document(start))
+    if end is not None:
+        query = query.where("__name__", "<", collection_ref.document(end))
+    query = query.order_by("__name__").limit(page_size)
+
+    last_doc = None
+    while True:
+        page_query = query.start_after(last_doc) if last_doc else query
+        page = list(page_query.stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        last_doc = page[-1]
+
+def iter_collection_pages(collection_ref, workers=READ_WORKERS, page_size=PAGE_SIZE, fields=None):
+    """
+    Lazily yield pages of snapshots from the whole collection, fetching the ID
+    ranges concurrently. Pages arrive in completion order, not document-ID order.
+    """
+    ranges = split_id_ranges(workers)
+    if len(ranges) == 1:
+        yield from iter_range_pages(collection_ref, page_size=page_size, fields=fields)
+        return
+
+    pages = queue.Queue(maxsize=len(ranges) * 2)
+    stop = threading.Event()
+
+    def put(item):
+        # Give up once the consumer has stopped iterating, instead of blocking forever
+        while not stop.is_set():
+            try:
+                pages.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def fetch(start, end):
+        try:
+            for page in iter_range_pages(collection_ref, start, end, page_size, fields):
+                if stop.is_set():
+                    return
+                put(page)
+        except Exception as e:
+            put(e)
+        finally:
+            put(_DONE)
+
+    executor = ThreadPoolExecutor(max_workers=len(ranges), thread_name_prefix="firestore-reader")
+    try:
+        for start, end in ranges:
+            executor.submit(fetch, start, end)
+        remaining = len(ranges)
+        while remaining:
+            item = pages.get()
+            if item is _DONE:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stop.set()
+        executor.shutdown(wait=False)
+
+def stream_collection(collection_ref, workers=READ_WORKERS, page_size=PAGE_SIZE, fields=None):
+    """Drop-in replacement for `collection_ref.stream()` that reads ranges in parallel."""
+    for page in iter_collection_pages(collection_ref, workers, page_size, fields):
+        yield from page
@@ -0,0 +1,81 @@
+import os
+import time
+import threading
+
+# ---------------------------
+# Realtime Firestore listener with coalesced flushes
+# ---------------------------
+# collection_ref.on_snapshot() delivers document changes on a background thread.
+# They are collected per document ID (only the latest version is kept) and handed
+# to `on_flush` every WATCH_WINDOW_SECONDS, so a burst of edits to one agent turns
+# into a single sheet update and the listener itself never waits on Sheets.
+#
+# The listener's first snapshot (every document) is flushed like any other change.
+# The preceding full sync may have been served from the snapshot cache, so this
+# catches whatever changed before the listener attached; callers upsert with
+# write_sheet_diff, so only rows that actually differ from the sheet are sent.
+
+WATCH_WINDOW_SECONDS = float(os.getenv("FIRESTORE_WATCH_WINDOW_SECONDS", "5"))
+
+class ChangeBuffer:
+    """Latest snapshot per changed document ID, plus the IDs that were removed."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changed = {}
+        self.removed = set()
+
+    def add(self, changes):
+        with self.lock:
+            for change in changes:
+                doc = change.document
+                if change.type.name == "REMOVED":
+                    self.changed.pop(doc.id, None)
+                    self.removed.add(doc.id)
+                else:
+                    self.changed[doc.id] = doc
+                    self.removed.discard(doc.id)
+
+    def drain(self):
+        with self.lock:
+            changed, removed = list(self.changed.values()), self.removed
+            self.changed, self.removed = {}, set()
+            return changed, removed
+
+    def requeue(self, changed, removed):
+        """Put back a batch that failed to flush, unless newer changes arrived meanwhile."""
+        with self.lock:
+            for doc in changed:
+                if doc.id not in self.removed:
+                    self.changed.setdefault(doc.id, doc)
+            self.removed |= {doc_id for doc_id in removed if doc_id not in self.changed}
+
+def watch_collection(collection_ref, on_flush, window_seconds=WATCH_WINDOW_SECONDS):
+    """
+    Listen to `collection_ref` until interrupted, calling on_flush(changed_snapshots,
+    removed_ids) once per window with everything that changed, starting with the
+    whole collection from the initial snapshot. A failed flush is retried with the
+    next window.
+    """
+    buffer = ChangeBuffer()
+
+    def on_snapshot(snapshots, changes, read_time):
+        buffer.add(changes)
+
+    watch = collection_ref.on_snapshot(on_snapshot)
+    print(f"👀 Watching '{collection_ref.id}' for changes (flushing every {window_seconds:g}s). Press Ctrl+C to stop.")
+    try:
+        while True:
+            time.sleep(window_seconds)
+            changed, removed = buffer.drain()
+            if not changed and not removed:
+                continue
+            try:
+                on_flush(changed, removed)
+            except Exception as e:
+                print(f"❌ Flushing {len(changed)} changes failed, retrying next window: {e}")
+                buffer.requeue(changed, removed)
+    except KeyboardInterrupt:
+        print("🛑 Stopped watching.")
+    finally:
+        watch.unsubscribe()
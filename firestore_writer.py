@@ -0,0 +1,121 @@
+import os
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from google.api_core import exceptions as api_exceptions
+
+# ---------------------------
+# Batched Firestore writes with parallel commits and retries
+# ---------------------------
+
+BATCH_LIMIT   = 500  # Firestore batch limit
+MAX_IN_FLIGHT = int(os.getenv("FIRESTORE_WRITE_IN_FLIGHT", "4"))
+MAX_RETRIES   = 5
+GET_ALL_CHUNK = 300
+
+RETRYABLE_ERRORS = (
+    api_exceptions.Aborted,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.InternalServerError,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+)
+
+# Errors returned before the commit was applied. DeadlineExceeded and InternalServerError
+# are ambiguous (the batch may have landed), so non-idempotent writes such as Increment
+# are only retried on these.
+UNAPPLIED_ERRORS = (
+    api_exceptions.Aborted,
+    api_exceptions.ResourceExhausted,
+    api_exceptions.ServiceUnavailable,
+)
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def get_existing_ids(db, collection_ref, doc_ids, chunk_size=GET_ALL_CHUNK):
+    """Return the subset of `doc_ids` that exist, looked up with db.get_all() in chunks."""
+    existing = set()
+    # Skip blanks and values that can't be document IDs
+    unique_ids = [
+        doc_id for doc_id in dict.fromkeys(doc_ids)
+        if isinstance(doc_id, str) and doc_id and "/" not in doc_id
+    ]
+    for chunk in chunked(unique_ids, chunk_size):
+        refs = [collection_ref.document(doc_id) for doc_id in chunk]
+        for snapshot in db.get_all(refs, field_paths=[]):
+            if snapshot.exists:
+                existing.add(snapshot.id)
+    return existing
+
+def _commit_with_retry(db, operations, max_retries, idempotent=True):
+    """
+    Build a fresh WriteBatch for each attempt, backing off on transient errors. With
+    idempotent=False, an ambiguous failure is raised instead of retried.
+    """
+    delay = 1
+    for attempt in range(1, max_retries + 1):
+        batch = db.batch()
+        for operation in operations:
+            method, doc_ref, data = operation[:3]
+            kwargs = operation[3] if len(operation) > 3 else {}
+            if method == "delete":
+                batch.delete(doc_ref)
+            else:
+                getattr(batch, method)(doc_ref, data, **kwargs)
+        try:
+            batch.commit()
+            return len(operations)
+        except RETRYABLE_ERRORS as e:
+            if not idempotent and not isinstance(e, UNAPPLIED_ERRORS):
+                print(f"⚠️ Batch commit failed ({e.__class__.__name__}) and may have been applied; not retrying.")
+                raise
+            if attempt == max_retries:
+                raise
+            wait_time = delay * (2 ** attempt) + random.uniform(0, 1)
+            print(f"⚠️ Batch commit failed ({e.__class__.__name__}). Retrying in {wait_time:.2f} seconds... (Attempt {attempt}/{max_retries})")
+            time.sleep(wait_time)
+
+def commit_in_batches(db, operations, batch_size=BATCH_LIMIT, max_in_flight=MAX_IN_FLIGHT,
+                      max_retries=MAX_RETRIES, on_progress=None, idempotent=True):
+    """
+    Commit (method, doc_ref, data[, kwargs]) operations in WriteBatches of `batch_size`,
+    with up to `max_in_flight` commits running at once. `method` is "set", "update"
+    or "delete". `on_progress(committed, failed)` is called from the calling thread
+    after each batch finishes. Pass idempotent=False for writes that must not be applied
+    twice (Increment, ArrayUnion of counters, ...): such batches are not retried after
+    DeadlineExceeded or InternalServerError, and count as failed. Returns (committed,
+    failed) operation counts.
+    """
+    committed = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="firestore-writer") as executor:
+        in_flight = {}
+
+        def collect(done):
+            nonlocal committed, failed
+            for future in done:
+                size = in_flight.pop(future)
+                try:
+                    committed += future.result()
+                    print(f"Committed a batch of {size} updates.")
+                except Exception as e:
+                    failed += size
+                    print(f"❌ Batch of {size} updates failed: {e}")
+                if on_progress:
+                    on_progress(committed, failed)
+
+        for chunk in chunked(operations, batch_size):
+            if len(in_flight) >= max_in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[executor.submit(_commit_with_retry, db, chunk, max_retries, idempotent)] = len(chunk)
+        collect(wait(in_flight).done)
+    return committed, failed
@@ -1,36 +1,21 @@
 import os
-import math
-import firebase_admin
-from firebase_admin import credentials, firestore
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime, timezone
 from dotenv import load_dotenv
+import pandas as pd
+import pyarrow as pa
 import sys, codecs
-
-# Ensure UTF-8 output (fixes UnicodeEncodeError on Windows)
-sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+from itertools import chain
+from snapshot_cache import read_through_pages
+from sheets_writer import write_sheet_diff
+from clients import get_firebase_app, get_firestore_client, get_sheets_service
+from transforms import records_to_frame, format_unix_dates, join_lists, dict_field, is_dict, to_text, scrub
+from parquet_export import parquet_requested, export_collection
 
 # Load environment variables from .env file
 load_dotenv()
 
-# ---------------------------
-# Firebase Configuration
-# ---------------------------
-FIREBASE_PROJECT_ID       = os.getenv("FIREBASE_PROJECT_ID")
-FIREBASE_PRIVATE_KEY_ID   = os.getenv("FIREBASE_PRIVATE_KEY_ID")
-FIREBASE_PRIVATE_KEY      = os.getenv("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n')
-FIREBASE_CLIENT_EMAIL     = os.getenv("FIREBASE_CLIENT_EMAIL")
-FIREBASE_CLIENT_ID        = os.getenv("FIREBASE_CLIENT_ID")
-
 # ---------------------------
 # Google Sheets Configuration
 # ---------------------------
-GSPREAD_PROJECT_ID        = os.getenv("GSPREAD_PROJECT_ID")
-GSPREAD_PRIVATE_KEY_ID    = os.getenv("GSPREAD_PRIVATE_KEY_ID")
-GSPREAD_PRIVATE_KEY       = os.getenv("GSPREAD_PRIVATE_KEY", "").replace('\\n', '\n')
-GSPREAD_CLIENT_EMAIL      = os.getenv("GSPREAD_CLIENT_EMAIL")
-GSPREAD_CLIENT_ID         = os.getenv("GSPREAD_CLIENT_ID")
 GOOGLE_SHEET_ID           = "1o6KI4tXt5yfIOHYQ9JH9RI1NK35DKrJRPHNf0srDnuo"
 
 # ---------------------------
@@ -43,156 +28,117 @@ FIRESTORE_COLLECTION_NAME = "ACN123"
 # ---------------------------
 def initialize_firebase():
     try:
-        cred_data = {
-            "type": "service_account",
-            "project_id": FIREBASE_PROJECT_ID,
-            "private_key_id": FIREBASE_PRIVATE_KEY_ID,
-            "private_key": FIREBASE_PRIVATE_KEY,
-            "client_email": FIREBASE_CLIENT_EMAIL,
-            "client_id": FIREBASE_CLIENT_ID,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{FIREBASE_CLIENT_EMAIL.replace('@', '%40')}"
-        }
-        cred = credentials.Certificate(cred_data)
-        firebase_admin.initialize_app(cred)
-        print("✅ Firebase initialized successfully.")
+        get_firebase_app()
     except Exception as e:
         print(f"❌ Error initializing Firebase: {e}")
 
 # ---------------------------
-# Convert Unix timestamp to ISO date
+# Sheet headers
 # ---------------------------
-def convert_unix_to_date(unix_timestamp):
-    try:
-        if not unix_timestamp:
-            return ""
-        # Return in ISO format to ensure Sheets parses as date
-        return datetime.fromtimestamp(int(unix_timestamp), tz=timezone.utc).strftime('%Y-%m-%d')
-    except Exception as e:
-        print(f"⚠️ Error converting timestamp {unix_timestamp}: {e}")
-        return ""
+HEADERS = [
+    "Property ID","CP Code","Name of The property","Asset Type","Sub Type",
+    "Plot Size","Carpet (Sq Ft)","SBUA (Sq ft)","Facing","Total Ask Price (Lacs)",
+    "Ask Price / Sqft","Unit Type","Micromarket","Extra Details","Floor No.",
+    "Handover Date","Area","Map Location","Date of inventory added","Date of status last checked",
+    "Drive link for more info","Building Khata","Land Khata","Building Age",
+    "Age of Inventory","Age of Status","Status","Tenanted or Not",
+    "OC Received or not","Current Status","Coordinates","Exclusive","Exact Floor",
+    "eKhata","Photo","Video","Document","Builder Name"
+]
+
+# Number of documents fetched, transformed and written per step
+PAGE_SIZE = int(os.getenv("INVENTORY_PAGE_SIZE", "500"))
+
+# Firestore field behind each column of HEADERS
+COLUMN_FIELDS = [
+    "propertyId", "cpCode", "nameOfTheProperty", "assetType", "subType",
+    "plotSize", "carpet", "sbua", "facing", "totalAskPrice",
+    "askPricePerSqft", "unitType", "micromarket", "extraDetails", "floorNo",
+    "handoverDate", "area", "mapLocation", "dateOfInventoryAdded", "dateOfStatusLastChecked",
+    "driveLink", "buildingKhata", "landKhata", "buildingAge",
+    "ageOfInventory", "ageOfStatus", "status", "tenanted",
+    "ocReceived", "currentStatus", "_geoloc", "exclusive", "exactFloor",
+    "eKhata", "photo", "video", "document", "builder_name"
+]
+DATE_FIELDS = ["dateOfInventoryAdded", "dateOfStatusLastChecked"]
+LIST_FIELDS = ["photo", "video", "document"]
+
+# Only the fields behind the columns are read from Firestore
+SELECT_FIELDS = list(dict.fromkeys(COLUMN_FIELDS))
+
+# Arrow types for the Parquet export; other columns are inferred
+PARQUET_TYPES = {
+    "_geoloc": pa.struct([("lat", pa.float64()), ("lng", pa.float64())]),
+    **{field: pa.list_(pa.string()) for field in LIST_FIELDS},
+}
 
 # ---------------------------
-# Fetch data from Firestore
+# Transform a page of documents into sheet rows, column by column
 # ---------------------------
+def build_inventory_rows(records):
+    frame = records_to_frame(records, COLUMN_FIELDS)
+    columns = {}
+    for field in COLUMN_FIELDS:
+        if field in DATE_FIELDS:
+            # ISO format to ensure Sheets parses as date
+            columns[field] = format_unix_dates(frame[field], '%Y-%m-%d')
+        elif field in LIST_FIELDS:
+            columns[field] = join_lists(frame[field])
+        elif field == "_geoloc":
+            lat = to_text(dict_field(frame[field], "lat"))
+            lng = to_text(dict_field(frame[field], "lng"))
+            columns[field] = (lat + ", " + lng).where(is_dict(frame[field]), "")
+        else:
+            columns[field] = frame[field]
+    return scrub(pd.DataFrame(columns, columns=COLUMN_FIELDS)).values.tolist()
+
 def fetch_firestore_data(collection_name):
-    try:
-        db = firestore.client()
-        print(f"🔍 Checking Firestore collection: {collection_name}")
-        docs = list(db.collection(collection_name).stream())
-        if not docs:
-            print("⚠️ No documents found in Firestore.")
-            return []
-        print(f"📄 Found {len(docs)} documents.")
-        rows = []
-        for doc in docs:
-            item = doc.to_dict() or {}
-            row = [
-                item.get("propertyId", ""),
-                item.get("cpCode", ""),
-                item.get("nameOfTheProperty", ""),
-                item.get("assetType", ""),
-                item.get("subType", ""),
-                item.get("plotSize", ""),
-                item.get("carpet", ""),
-                item.get("sbua", ""),
-                item.get("facing", ""),
-                item.get("totalAskPrice", ""),
-                item.get("askPricePerSqft", ""),
-                item.get("unitType", ""),
-                item.get("micromarket", ""),
-                item.get("extraDetails", ""),
-                item.get("floorNo", ""),
-                item.get("handoverDate", ""),
-                item.get("area", ""),
-                item.get("mapLocation", ""),
-                convert_unix_to_date(item.get("dateOfInventoryAdded")),
-                convert_unix_to_date(item.get("dateOfStatusLastChecked")),
-                item.get("driveLink", ""),
-                item.get("buildingKhata", ""),
-                item.get("landKhata", ""),
-                item.get("buildingAge", ""),
-                item.get("ageOfInventory", ""),
-                item.get("ageOfStatus", ""),
-                item.get("status", ""),
-                item.get("tenanted", ""),
-                item.get("ocReceived", ""),
-                item.get("currentStatus", ""),
-                (f"{item.get('_geoloc', {}).get('lat','')}, {item.get('_geoloc', {}).get('lng','')}" if isinstance(item.get('_geoloc'), dict) else ""),
-                item.get("exclusive", ""),
-                item.get("exactFloor", ""),
-                item.get("eKhata", ""),
-                ", ".join(item.get("photo", [])) if isinstance(item.get("photo"), list) else item.get("photo", ""),
-                ", ".join(item.get("video", [])) if isinstance(item.get("video"), list) else item.get("video", ""),
-                ", ".join(item.get("document", [])) if isinstance(item.get("document"), list) else item.get("document", ""),
-                item.get("builder_name", ""),
-                
-            ]
-            rows.append(row)
-        print(f"✅ Successfully fetched {len(rows)} records from Firestore.")
-        return rows
-    except Exception as e:
-        print(f"❌ Error fetching data from Firestore: {e}")
-        return []
+    """Yield sanitized row chunks, keeping only a bounded number of pages in memory."""
+    print(f"🔍 Checking Firestore collection: {collection_name}")
+    collection_ref = get_firestore_client().collection(collection_name)
+    for page in read_through_pages(collection_ref, page_size=PAGE_SIZE, fields=SELECT_FIELDS):
+        yield build_inventory_rows([doc.to_dict() or {} for doc in page])
 
 # ---------------------------
 # Write data to Google Sheets
 # ---------------------------
-def write_to_google_sheet(data):
+def write_to_google_sheet(chunks):
+    """Diff the streamed chunks against the sheet (keyed on Property ID) and send only changes."""
     try:
-        if not data:
+        chunks = iter(chunks)
+        first_chunk = next(chunks, None)
+        if not first_chunk:
             print("⚠️ No data to write to Google Sheets.")
-            return
-        creds_data = {
-            "type": "service_account",
-            "project_id": GSPREAD_PROJECT_ID,
-            "private_key_id": GSPREAD_PRIVATE_KEY_ID,
-            "private_key": GSPREAD_PRIVATE_KEY,
-            "client_email": GSPREAD_CLIENT_EMAIL,
-            "client_id": GSPREAD_CLIENT_ID,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{GSPREAD_CLIENT_EMAIL.replace('@','%40')}"
-        }
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_info(creds_data, scopes=scopes)
-        gc = gspread.authorize(creds)
-        sheet = gc.open_by_key(GOOGLE_SHEET_ID).sheet1
-        # Headers
-        headers = [
-            "Property ID","CP Code","Name of The property","Asset Type","Sub Type",
-            "Plot Size","Carpet (Sq Ft)","SBUA (Sq ft)","Facing","Total Ask Price (Lacs)",
-            "Ask Price / Sqft","Unit Type","Micromarket","Extra Details","Floor No.",
-            "Handover Date","Area","Map Location","Date of inventory added","Date of status last checked",
-            "Drive link for more info","Building Khata","Land Khata","Building Age",
-            "Age of Inventory","Age of Status","Status","Tenanted or Not",
-            "OC Received or not","Current Status","Coordinates","Exclusive","Exact Floor",
-            "eKhata","Photo","Video","Document","Builder Name"
-        ]
-        payload = [headers] + data
-        # Sanitize
-        sanitized = []
-        for row in payload:
-            new_row = ["" if (isinstance(cell, float) and math.isnan(cell)) or cell is None else str(cell) for cell in row]
-            sanitized.append(new_row)
-        # Clear then update with USER_ENTERED
-        sheet.clear()
-        sheet.update("A1", sanitized, value_input_option='USER_ENTERED')
+            return {}
+        service = get_sheets_service()
+        # Rows stream straight from Firestore into the diff; USER_ENTERED so dates parse as dates
+        rows = chain.from_iterable(chain([first_chunk], chunks))
+        summary = write_sheet_diff(
+            service, GOOGLE_SHEET_ID, None, HEADERS, rows, "Property ID",
+            value_input_option='USER_ENTERED'
+        )
         print("✅ Data written successfully (dates parsed as dates).")
+        return summary
     except Exception as e:
         print(f"❌ Error writing to Google Sheets: {e}")
+        return None
 
 # Main
-def main():
+def main(argv=None):
+    """Run the sync; returns True on success, False if any step failed."""
+    argv = sys.argv[1:] if argv is None else argv
     initialize_firebase()
-    data = fetch_firestore_data(FIRESTORE_COLLECTION_NAME)
-    if data:
-        write_to_google_sheet(data)
-    else:
-        print("⚠️ No data to write to Google Sheets.")
+    # None means the write failed; {} means there was nothing to write
+    ok = write_to_google_sheet(fetch_firestore_data(FIRESTORE_COLLECTION_NAME)) is not None
+    if parquet_requested(argv):
+        path = export_collection(
+            get_firestore_client().collection(FIRESTORE_COLLECTION_NAME), PARQUET_TYPES, DATE_FIELDS,
+            partition_field="dateOfInventoryAdded", fields=SELECT_FIELDS, page_size=PAGE_SIZE
+        )
+        ok = ok and path is not None
+    return ok
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Ensure UTF-8 output (fixes UnicodeEncodeError on Windows)
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+    sys.exit(0 if main() else 1)
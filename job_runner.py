@@ -0,0 +1,394 @@
+import os
+import io
+import sys
+import time
+import uuid
+import socket
+import threading
+import subprocess
+import importlib.util
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# ---------------------------
+# Background job runner for the sync scripts
+# ---------------------------
+# Scripts run on a worker pool, their output is collected line by line while they
+# run, and every job can be polled or cancelled by ID from any Streamlit session.
+# By default a script's main(argv) is called in a pool of long-lived worker
+# processes, so imports, Firebase apps and open connections stay warm between runs.
+# A worker runs one job at a time and sends everything printed while it runs
+# (from any thread) back to the runner, so the host process's stdout and threads
+# are left alone. main() returns True/False (or an exit code) for the job status.
+# A running warm job can't be stopped, so jobs submitted as cancellable spawn a
+# fresh interpreter instead, as every job does with JOB_RUNNER_MODE=subprocess.
+#
+# While a job runs it holds a lock file per script in SCHEDULER_LOCK_DIR, so a
+# script never runs twice at once, whether it was started by the scheduler or
+# from the dashboard, in this process or another one. The lock is touched every
+# LOCK_HEARTBEAT_SECONDS; it is only broken when its owner is gone (dead PID on
+# this host) or it hasn't been touched for SCHEDULER_LOCK_TIMEOUT_SECONDS.
+# Only the last JOB_HISTORY_LIMIT finished jobs are kept.
+
+MAX_CONCURRENT_JOBS    = int(os.getenv("MAX_CONCURRENT_JOBS", "4"))
+MAX_OUTPUT_LINES       = 5000
+WARM_WORKERS           = os.getenv("JOB_RUNNER_MODE", "warm") != "subprocess"
+OUTPUT_DRAIN_SECONDS   = 5
+JOB_HISTORY_LIMIT      = int(os.getenv("JOB_HISTORY_LIMIT", "50"))
+LOCK_DIR               = os.getenv("SCHEDULER_LOCK_DIR", ".scheduler-locks")
+LOCK_TIMEOUT_SECONDS   = float(os.getenv("SCHEDULER_LOCK_TIMEOUT_SECONDS", "600"))
+LOCK_HEARTBEAT_SECONDS = 60
+HOSTNAME               = socket.gethostname()
+
+def succeeded(result):
+    """main() may return True/False, an exit code, or None (no status reported)."""
+    if result is None or result is True:
+        return True
+    if result is False:
+        return False
+    return result == 0
+
+# ---------------------------
+# Per-script lock files shared by every runner
+# ---------------------------
+def lock_path(script):
+    return os.path.join(LOCK_DIR, os.path.splitext(os.path.basename(script))[0] + ".lock")
+
+def pid_running(pid):
+    if os.name == "nt":
+        # os.kill(pid, 0) would send CTRL_C_EVENT on Windows; rely on the heartbeat there
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def lock_is_stale(path):
+    """A lock is stale if its owner on this host is dead, or nobody touched it for the timeout."""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            owner = f.read().split()
+        age = time.time() - os.path.getmtime(path)
+    except FileNotFoundError:
+        return True
+    except OSError:
+        return False
+    if len(owner) >= 2 and owner[1] == HOSTNAME and owner[0].isdigit() and not pid_running(int(owner[0])):
+        return True
+    return age > LOCK_TIMEOUT_SECONDS
+
+def break_stale_lock(script, path):
+    """
+    Move a stale lock aside; True if the lock is gone. The rename is atomic, so when
+    several runners break the same lock only one rename succeeds. A runner that judged
+    an older file stale but moved a lock created since then puts that lock back.
+    """
+    try:
+        inode = os.stat(path).st_ino
+    except FileNotFoundError:
+        return True
+    if not lock_is_stale(path):
+        return False
+    broken_path = f"{path}.{uuid.uuid4().hex}.stale"
+    try:
+        os.rename(path, broken_path)
+    except FileNotFoundError:
+        # Another runner broke it first; race it for the new lock
+        return True
+    if os.stat(broken_path).st_ino != inode:
+        try:
+            os.link(broken_path, path)
+        except OSError:
+            pass
+        os.remove(broken_path)
+        return False
+    print(f"⚠️ Breaking stale lock for '{script}'.")
+    os.remove(broken_path)
+    return True
+
+def acquire_lock(script):
+    """Create the script's lock file; False if a live run holds it. Stale locks are broken."""
+    os.makedirs(LOCK_DIR, exist_ok=True)
+    path = lock_path(script)
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            if not break_stale_lock(script, path):
+                return False
+            continue
+        with os.fdopen(fd, "w") as f:
+            f.write(f"{os.getpid()} {HOSTNAME} {time.time()}")
+        return True
+    return False
+
+def touch_lock(script):
+    try:
+        os.utime(lock_path(script))
+    except FileNotFoundError:
+        pass
+
+def release_lock(script):
+    try:
+        os.remove(lock_path(script))
+    except FileNotFoundError:
+        pass
+
+_loaded_scripts = {}
+_load_lock = threading.Lock()
+
+def load_script(path):
+    """Import a (possibly hyphenated) script file once, reloading it only when it changes."""
+    mtime = os.path.getmtime(path)
+    with _load_lock:
+        cached = _loaded_scripts.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        name = "job_" + os.path.splitext(os.path.basename(path))[0].replace("-", "_")
+        spec = importlib.util.spec_from_file_location(name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _loaded_scripts[path] = (mtime, module)
+        return module
+
+# ---------------------------
+# Warm worker processes
+# ---------------------------
+_output_queue = None
+
+def _init_worker(output_queue):
+    global _output_queue
+    _output_queue = output_queue
+
+class QueueOutput(io.TextIOBase):
+    """A worker's stdout while it runs a job: text goes back to the runner tagged with the job ID."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+
+    def writable(self):
+        return True
+
+    def write(self, text):
+        if text:
+            _output_queue.put((self.job_id, text))
+        return len(text)
+
+def run_in_worker(path, argv, job_id):
+    """Call the script's main(argv) in this worker process; returns what main() returned."""
+    # The worker runs nothing else meanwhile, so its own stdout can carry the job's output
+    sys.stdout = sys.stderr = QueueOutput(job_id)
+    try:
+        return load_script(path).main(list(argv))
+    except SystemExit as e:
+        return e.code
+    except Exception as e:
+        print(f"💥 Error: {e}")
+        return False
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        # Marks the end of the job's output
+        _output_queue.put((job_id, None))
+
+class Job:
+    def __init__(self, name, script, argv=(), warm=True):
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.script = script
+        self.argv = list(argv)
+        self.warm = warm
+        self.status = "queued"  # queued -> running -> succeeded / failed / cancelled; or skipped
+        self.lines = []
+        self.returncode = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.process = None
+        self.future = None
+        self.cancel_requested = False
+        self._partial = ""
+        self._write_lock = threading.Lock()
+        self.output_done = threading.Event()
+
+    @property
+    def done(self):
+        return self.status in ("succeeded", "failed", "cancelled", "skipped")
+
+    @property
+    def duration(self):
+        if not self.started_at:
+            return 0.0
+        return round((self.finished_at or time.time()) - self.started_at, 2)
+
+    @property
+    def cancellable(self):
+        # Warm jobs can only be cancelled before they start
+        return self.status == "queued" or (self.status == "running" and self.process is not None)
+
+    def output(self):
+        return "\n".join(self.lines + ([self._partial] if self._partial else [])) or "No output received"
+
+    def add_line(self, line):
+        self.lines.append(line)
+        if len(self.lines) > MAX_OUTPUT_LINES:
+            del self.lines[:len(self.lines) - MAX_OUTPUT_LINES]
+
+    def write(self, text):
+        # Called from every thread the job started, so lines are assembled under a lock
+        with self._write_lock:
+            *complete, self._partial = (self._partial + text).split("\n")
+            for line in complete:
+                self.add_line(line)
+
+class JobRunner:
+    def __init__(self, max_workers=MAX_CONCURRENT_JOBS, python_executable=sys.executable, warm=WARM_WORKERS):
+        self.python_executable = python_executable
+        self.max_workers = max_workers
+        self.warm = warm
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job-runner")
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.workers = None
+        # spawn rather than fork: the host (Streamlit, gRPC) has threads running
+        self.mp_context = multiprocessing.get_context("spawn")
+        self.output_queue = self.mp_context.Queue() if warm else None
+        if warm:
+            threading.Thread(target=self._collect_output, name="job-runner-output", daemon=True).start()
+        threading.Thread(target=self._heartbeat, name="job-runner-heartbeat", daemon=True).start()
+
+    def submit(self, name, script, argv=(), cancellable=False):
+        """
+        Queue a script with its command-line arguments; if the same script with the same
+        arguments is already queued or running, return that job's ID. Cancellable jobs run in a subprocess
+        so they can be stopped while running.
+        """
+        with self.lock:
+            for job in self.jobs.values():
+                if job.script == script and job.argv == list(argv) and not job.done:
+                    return job.id
+            self._prune()
+            job = Job(name, script, argv, warm=self.warm and not cancellable)
+            self.jobs[job.id] = job
+            job.future = self.executor.submit(self._run, job)
+            return job.id
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond JOB_HISTORY_LIMIT (call with self.lock held)."""
+        finished = sorted((job for job in self.jobs.values() if job.done), key=lambda job: job.created_at)
+        for job in finished[:max(len(finished) - JOB_HISTORY_LIMIT, 0)]:
+            del self.jobs[job.id]
+
+    def _heartbeat(self):
+        # Keep the lock files of running jobs fresh so other runners don't break them
+        while True:
+            time.sleep(LOCK_HEARTBEAT_SECONDS)
+            with self.lock:
+                running = [job.script for job in self.jobs.values() if job.status == "running"]
+            for script in running:
+                touch_lock(script)
+
+    def _collect_output(self):
+        # Output of warm jobs, sent by the worker processes
+        while True:
+            job_id, text = self.output_queue.get()
+            job = self.jobs.get(job_id)
+            if job is None:
+                continue
+            if text is None:
+                job.output_done.set()
+            else:
+                job.write(text)
+
+    def _worker_pool(self):
+        with self.lock:
+            if self.workers is None:
+                self.workers = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=self.mp_context,
+                    initializer=_init_worker, initargs=(self.output_queue,)
+                )
+            return self.workers
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self.lock:
+            return sorted(self.jobs.values(), key=lambda job: job.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        job = self.jobs.get(job_id)
+        if not job or not job.cancellable:
+            return False
+        job.cancel_requested = True
+        if job.future and job.future.cancel():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+        elif job.process:
+            job.process.terminate()
+        return True
+
+    def _run(self, job):
+        if job.cancel_requested:
+            job.status = "cancelled"
+            return
+        path = os.path.join(os.getcwd(), job.script)
+        job.started_at = time.time()
+        if not os.path.exists(path):
+            job.add_line(f"⚠️ Script not found: `{job.script}`")
+            job.status = "failed"
+            job.finished_at = time.time()
+            return
+        if not acquire_lock(job.script):
+            job.add_line(f"⏭️ `{job.script}` is already running elsewhere, skipped.")
+            job.status = "skipped"
+            job.finished_at = time.time()
+            return
+        job.status = "running"
+        try:
+            if job.warm:
+                self._run_warm(job, path)
+            else:
+                self._run_subprocess(job, path)
+        except Exception as e:
+            job.add_line(f"💥 Error: {e}")
+            job.status = "failed"
+        finally:
+            if job._partial:
+                job.add_line(job._partial)
+                job._partial = ""
+            job.finished_at = time.time()
+            release_lock(job.script)
+
+    def _run_warm(self, job, path):
+        workers = self._worker_pool()
+        try:
+            result = workers.submit(run_in_worker, path, job.argv, job.id).result()
+        except BrokenProcessPool:
+            # A worker died mid-job (crash, os._exit); start a fresh pool for the next job
+            with self.lock:
+                if self.workers is workers:
+                    self.workers = None
+            raise
+        # The end-of-output marker travels behind the job's last lines
+        job.output_done.wait(OUTPUT_DRAIN_SECONDS)
+        job.returncode = 0 if succeeded(result) else 1
+        job.status = "succeeded" if job.returncode == 0 else "failed"
+
+    def _run_subprocess(self, job, path):
+        job.process = subprocess.Popen(
+            [self.python_executable, "-u", path, *job.argv],
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, encoding="utf-8", errors="replace",
+            env={**os.environ, "PYTHONUTF8": "1", "PYTHONUNBUFFERED": "1"}
+        )
+        for line in job.process.stdout:
+            job.add_line(line.rstrip("\n"))
+        job.returncode = job.process.wait()
+        if job.cancel_requested:
+            job.status = "cancelled"
+        else:
+            job.status = "succeeded" if job.returncode == 0 else "failed"
@@ -0,0 +1,261 @@
+import os
+import json
+import shutil
+import datetime
+import pyarrow as pa
+import pyarrow.parquet as pq
+from firestore_reader import PAGE_SIZE
+from snapshot_cache import read_through_pages
+
+# ---------------------------
+# Partitioned Parquet export of Firestore collections
+# ---------------------------
+# Writes <PARQUET_EXPORT_DIR>/<collection>/<partition>_month=YYYY-MM/part-*.parquet
+# with real Arrow types: unix-second fields become UTC timestamps, arrays become list
+# columns and maps (budget, _geoloc) become structs. The collection is read twice:
+# the first pass collects every field and widens each column's type until it holds
+# every value (int + float -> float, anything mixed -> string, struct fields merged),
+# starting from the exporter's declared types; the second pass writes the pages
+# with that one schema. A value that still doesn't fit (the collection changed
+# between the passes) fails the export rather than being dropped. The dataset is
+# built in a temp directory and swapped in at the end, so readers never see a
+# half-written export.
+#
+# Exporters run it after the sheet sync when called with --parquet or when
+# PARQUET_EXPORT=1 is set. Reads go through the local snapshot cache, so both
+# passes over the collection are served from disk.
+
+PARQUET_EXPORT_DIR = os.getenv("PARQUET_EXPORT_DIR", "parquet-exports")
+PARQUET_EXPORT     = os.getenv("PARQUET_EXPORT", "0") == "1"
+
+TIMESTAMP = pa.timestamp("s", tz="UTC")
+UNKNOWN_PARTITION = "unknown"
+
+def parquet_requested(argv):
+    return PARQUET_EXPORT or "--parquet" in argv
+
+def to_seconds(value):
+    """Unix seconds from an int/float/numeric string or ISO date string; 0 and junk -> None."""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        value = value.isoformat()
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            try:
+                parsed = datetime.datetime.fromisoformat(value)
+            except ValueError:
+                return None
+            if parsed.tzinfo is None:
+                parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+            return int(parsed.timestamp())
+    if isinstance(value, (int, float)) and value == value and value != 0:
+        return int(value)
+    return None
+
+INT64_MIN, INT64_MAX = -2 ** 63, 2 ** 63 - 1
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def is_empty_date(value):
+    # 0 and "" mean "no date" in these collections
+    return value is None or value == "" or (is_number(value) and value == 0)
+
+def value_type(value):
+    """Arrow type of one Python value (None -> null)."""
+    if value is None:
+        return pa.null()
+    if isinstance(value, bool):
+        return pa.bool_()
+    if isinstance(value, int):
+        return pa.int64() if INT64_MIN <= value <= INT64_MAX else pa.string()
+    if isinstance(value, float):
+        return pa.float64()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return TIMESTAMP
+    if isinstance(value, list):
+        return widen(pa.list_(pa.null()), value)
+    if isinstance(value, dict):
+        return widen(pa.struct([]), value)
+    return pa.string()
+
+def widen(arrow_type, value):
+    """Narrowest type that holds both everything `arrow_type` holds and `value`."""
+    if value is None:
+        return arrow_type
+    if arrow_type is None or pa.types.is_null(arrow_type):
+        return value_type(value)
+    if pa.types.is_string(arrow_type):
+        return arrow_type
+    if pa.types.is_timestamp(arrow_type):
+        return arrow_type if is_empty_date(value) or to_seconds(value) is not None else pa.string()
+    if pa.types.is_boolean(arrow_type):
+        return arrow_type if isinstance(value, bool) else pa.string()
+    if pa.types.is_integer(arrow_type):
+        if isinstance(value, int) and not isinstance(value, bool):
+            return arrow_type if INT64_MIN <= value <= INT64_MAX else pa.string()
+        return pa.float64() if isinstance(value, float) else pa.string()
+    if pa.types.is_floating(arrow_type):
+        return arrow_type if is_number(value) else pa.string()
+    if pa.types.is_list(arrow_type):
+        if not isinstance(value, list):
+            return pa.string()
+        item_type = arrow_type.value_type
+        for item in value:
+            item_type = widen(item_type, item)
+        return pa.list_(item_type)
+    if pa.types.is_struct(arrow_type):
+        if not isinstance(value, dict):
+            return pa.string()
+        fields = {field.name: field.type for field in arrow_type}
+        for key, item in value.items():
+            fields[str(key)] = widen(fields.get(str(key)), item)
+        return pa.struct(list(fields.items()))
+    return pa.string()
+
+def finalize_type(arrow_type):
+    """Replace types Parquet can't store (null, empty struct) with strings, recursively."""
+    if arrow_type is None or pa.types.is_null(arrow_type):
+        return pa.string()
+    if pa.types.is_list(arrow_type):
+        return pa.list_(finalize_type(arrow_type.value_type))
+    if pa.types.is_struct(arrow_type):
+        if arrow_type.num_fields == 0:
+            return pa.string()
+        return pa.struct([(field.name, finalize_type(field.type)) for field in arrow_type])
+    return arrow_type
+
+def coerce(value, arrow_type):
+    """Fit one Python value to `arrow_type`; raises ValueError if it would lose the value."""
+    if value is None:
+        return None
+    if pa.types.is_timestamp(arrow_type):
+        seconds = to_seconds(value)
+        if seconds is None and not is_empty_date(value):
+            raise ValueError(f"{value!r} is not a date")
+        return seconds
+    if pa.types.is_string(arrow_type):
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, ensure_ascii=False, default=str)
+        return str(value)
+    if pa.types.is_list(arrow_type) and isinstance(value, list):
+        return [coerce(item, arrow_type.value_type) for item in value]
+    if pa.types.is_struct(arrow_type) and isinstance(value, dict):
+        names = {field.name for field in arrow_type}
+        if set(map(str, value)) - names:
+            raise ValueError(f"unexpected keys {sorted(set(map(str, value)) - names)}")
+        return {field.name: coerce(value.get(field.name), field.type) for field in arrow_type}
+    if pa.types.is_boolean(arrow_type) and isinstance(value, bool):
+        return value
+    if pa.types.is_integer(arrow_type) and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if pa.types.is_floating(arrow_type) and is_number(value):
+        return float(value)
+    raise ValueError(f"{value!r} does not fit {arrow_type}")
+
+def partition_value(value):
+    seconds = to_seconds(value)
+    if seconds is None:
+        return UNKNOWN_PARTITION
+    return datetime.datetime.fromtimestamp(seconds, tz=datetime.timezone.utc).strftime("%Y-%m")
+
+class ParquetDataset:
+    """One export of a collection to a month-partitioned Parquet dataset."""
+
+    def __init__(self, name, types=None, timestamp_fields=(), partition_field="added",
+                 root=PARQUET_EXPORT_DIR):
+        self.path = os.path.join(root, name)
+        self.temp_path = self.path + ".tmp"
+        self.types = dict(types or {})
+        self.types.update({field: TIMESTAMP for field in timestamp_fields})
+        self.partition_field = partition_field
+        self.partition_column = f"{partition_field}_month"
+        self.column_types = {}
+        self.schema = None
+        self.parts = 0
+        self.rows = 0
+        shutil.rmtree(self.temp_path, ignore_errors=True)
+
+    def scan(self, records):
+        """First pass: widen each column's type to hold every value in `records`."""
+        for record in records:
+            for name, value in record.items():
+                if name not in self.column_types:
+                    self.column_types[name] = self.types.get(name)
+                self.column_types[name] = widen(self.column_types[name], value)
+
+    def build_schema(self):
+        for name, declared in self.types.items():
+            widened = self.column_types.get(name)
+            if widened is not None and declared is not None and widened != declared:
+                print(f"⚠️ Column '{name}' doesn't fit {declared}, exporting it as {finalize_type(widened)}.")
+        fields = [pa.field("id", pa.string())]
+        for name in sorted(set(self.column_types) - {"id", self.partition_column}):
+            fields.append(pa.field(name, finalize_type(self.column_types[name])))
+        fields.append(pa.field(self.partition_column, pa.string()))
+        self.schema = pa.schema(fields)
+
+    def build_table(self, doc_ids, records):
+        if self.schema is None:
+            self.build_schema()
+        unknown = {key for record in records for key in record} - set(self.schema.names)
+        if unknown:
+            raise ValueError(f"fields {sorted(unknown)} appeared after the schema was built; rerun the export")
+
+        columns = [pa.array(doc_ids, pa.string())]
+        for field in self.schema:
+            if field.name in ("id", self.partition_column):
+                continue
+            try:
+                values = [coerce(record.get(field.name), field.type) for record in records]
+            except ValueError as e:
+                raise ValueError(f"column '{field.name}': {e}; rerun the export") from None
+            columns.append(pa.array(values, field.type))
+        columns.append(pa.array(
+            [partition_value(record.get(self.partition_field)) for record in records], pa.string()
+        ))
+        return pa.Table.from_arrays(columns, schema=self.schema)
+
+    def write(self, doc_ids, records):
+        if not records:
+            return
+        pq.write_to_dataset(
+            self.build_table(doc_ids, records), self.temp_path,
+            partition_cols=[self.partition_column],
+            basename_template=f"part-{self.parts:05d}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore"
+        )
+        self.parts += 1
+        self.rows += len(records)
+
+    def commit(self):
+        """Swap the finished export in place of the previous one."""
+        if not self.parts:
+            print(f"⚠️ Nothing exported to {self.path}.")
+            return
+        old_path = self.path + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(self.temp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        print(f"✅ Exported {self.rows} documents to Parquet dataset {self.path}")
+
+def export_collection(collection_ref, types=None, timestamp_fields=(), partition_field="added",
+                      fields=None, page_size=PAGE_SIZE):
+    """Read a collection twice (through the snapshot cache): once for the schema, once to write it."""
+    dataset = ParquetDataset(collection_ref.id, types, timestamp_fields, partition_field)
+    try:
+        for page in read_through_pages(collection_ref, page_size=page_size, fields=fields):
+            dataset.scan([doc.to_dict() or {} for doc in page])
+        for page in read_through_pages(collection_ref, page_size=page_size, fields=fields):
+            dataset.write([doc.id for doc in page], [doc.to_dict() or {} for doc in page])
+        dataset.commit()
+        return dataset.path
+    except Exception as e:
+        shutil.rmtree(dataset.temp_path, ignore_errors=True)
+        print(f"❌ Error exporting '{collection_ref.id}' to Parquet: {e}")
+        return None
@@ -1,10 +1,13 @@
 import streamlit as st
 import os
+import io
+import csv
+import time
 import datetime
 import pytz
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore
+from agent_plans import PLAN_CONFIGS, update_plan, add_credits, build_bulk_changes, apply_bulk_changes
+from clients import get_firestore_client
 
 # Set page config - MUST BE THE FIRST STREAMLIT COMMAND
 st.set_page_config(
@@ -20,24 +23,7 @@ load_dotenv()
 # Initialize Firebase Admin SDK using environment variables
 @st.cache_resource
 def initialize_firebase():
-    try:
-        firebase_admin.get_app()
-    except ValueError:
-        firebase_credentials = {
-            "type": "service_account",
-            "project_id": os.getenv("FIREBASE_PROJECT_ID"),
-            "private_key_id": os.getenv("FIREBASE_PRIVATE_KEY_ID"),
-            "private_key": os.getenv("FIREBASE_PRIVATE_KEY").replace("\\n", "\n"),
-            "client_email": os.getenv("FIREBASE_CLIENT_EMAIL"),
-            "client_id": os.getenv("FIREBASE_CLIENT_ID"),
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": os.getenv("FIREBASE_CLIENT_CERT_URL")
-        }
-        cred = credentials.Certificate(firebase_credentials)
-        firebase_admin.initialize_app(cred)
-    return firestore.client()
+    return get_firestore_client()
 
 # Initialize Firebase and get database reference
 db = initialize_firebase()
@@ -55,10 +41,28 @@ def standardize_phone_number(phone):
     else:
         return '+91' + phone
 
+# Lookups are cached per Streamlit session so reruns don't re-query Firestore
+AGENT_CACHE_TTL_SECONDS = int(os.getenv("AGENT_CACHE_TTL_SECONDS", "120"))
+
+def get_agent_cache():
+    """Session-scoped cache: standardized phone -> (fetched_at, agent_data)"""
+    if "agent_cache" not in st.session_state:
+        st.session_state.agent_cache = {}
+    return st.session_state.agent_cache
+
+def invalidate_agent(phone_number):
+    """Drop a cached agent so the next lookup reads fresh data"""
+    get_agent_cache().pop(standardize_phone_number(phone_number), None)
+
 def get_agent_by_phone(phone_number):
     """Fetch agent data by phone number"""
     try:
         phone_number = standardize_phone_number(phone_number)
+        cache = get_agent_cache()
+        cached = cache.get(phone_number)
+        if cached and time.time() - cached[0] < AGENT_CACHE_TTL_SECONDS:
+            return dict(cached[1]), None
+
         agents_ref = db.collection('agents')
         query = agents_ref.where('phonenumber', '==', phone_number).limit(1)
         results = query.get()
@@ -66,7 +70,8 @@ def get_agent_by_phone(phone_number):
         if results:
             agent_data = results[0].to_dict()
             agent_data['id'] = results[0].id
-            return agent_data, None
+            cache[phone_number] = (time.time(), agent_data)
+            return dict(agent_data), None
         else:
             return None, f"No agent found with phone number {phone_number}"
     except Exception as e:
@@ -75,55 +80,13 @@ def get_agent_by_phone(phone_number):
 def update_user_plan(phone_number, plan, agent_data):
     """Update user's subscription plan"""
     try:
-        current_date = datetime.datetime.now(pytz.timezone('Asia/Kolkata'))
-        current_timestamp = int(current_date.timestamp())
-
-        # Plan configurations
-        plan_configs = {
-            "premium": {
-                "expiry_days": 365,
-                "monthly_credits": 100,
-                "user_type": "premium"
-            },
-            "trial": {
-                "expiry_days": 30,
-                "monthly_credits": 100,
-                "user_type": "trial"
-            },
-            "basic": {
-                "expiry_days": 30,
-                "monthly_credits": 5,
-                "user_type": "basic"
-            }
-        }
-
-        config = plan_configs.get(plan)
+        config = PLAN_CONFIGS.get(plan)
         if not config:
             return False, "Invalid plan selected"
 
-        # Calculate dates
-        next_renewal = current_date + datetime.timedelta(days=30)
-        plan_expiry = current_date + datetime.timedelta(days=config["expiry_days"])
-
-        # Prepare update data
-        update_data = {
-            'nextRenewal': int(next_renewal.timestamp()),
-            'userType': config["user_type"],
-            'planExpiry': int(plan_expiry.timestamp()),
-            'monthlyCredits': config["monthly_credits"],
-            'updatedAt': current_timestamp,
-            'lastModified': current_timestamp
-        }
-
-        # Handle trial usage tracking
-        previous_plan = agent_data.get('userType', None)
-        if previous_plan == "basic" and plan != "basic":
-            update_data['trialUsed'] = True
-            update_data['trialStartedAt'] = current_timestamp
-
-        # Update document
-        agent_ref = db.collection('agents').document(agent_data['id'])
-        agent_ref.update(update_data)
+        # Update document; retried automatically if another write lands first
+        plan_expiry = update_plan(db, agent_data['id'], plan)
+        invalidate_agent(phone_number)
         
         return True, f"Successfully updated plan to {plan.upper()}. New expiry: {plan_expiry.strftime('%Y-%m-%d')}, Credits: {config['monthly_credits']}"
     
@@ -133,20 +96,10 @@ def update_user_plan(phone_number, plan, agent_data):
 def add_manual_credits(phone_number, credits_to_add, agent_data):
     """Add manual credits to user account"""
     try:
-        current_timestamp = int(datetime.datetime.now(pytz.timezone('Asia/Kolkata')).timestamp())
-        current_credits = agent_data.get('monthlyCredits', 0)
-        new_credits = current_credits + credits_to_add
-
-        update_data = {
-            'monthlyCredits': new_credits,
-            'updatedAt': current_timestamp,
-            'lastModified': current_timestamp
-        }
-
-        agent_ref = db.collection('agents').document(agent_data['id'])
-        agent_ref.update(update_data)
+        add_credits(db, agent_data['id'], credits_to_add)
+        invalidate_agent(phone_number)
         
-        return True, f"Successfully added {credits_to_add} credits. New total: {new_credits}"
+        return True, f"Successfully added {credits_to_add} credits."
     
     except Exception as e:
         return False, f"Failed to add credits: {str(e)}"
@@ -166,6 +119,7 @@ def toggle_blacklist(phone_number, agent_data):
 
         agent_ref = db.collection('agents').document(agent_data['id'])
         agent_ref.update(update_data)
+        invalidate_agent(phone_number)
         
         status = "blacklisted" if new_blacklist_status else "unblacklisted"
         return True, f"Successfully {status} the agent"
@@ -173,6 +127,52 @@ def toggle_blacklist(phone_number, agent_data):
     except Exception as e:
         return False, f"Failed to update blacklist status: {str(e)}"
 
+# Firestore allows at most 30 values in an `in` filter
+IN_QUERY_LIMIT = 30
+
+def read_bulk_csv(uploaded_file):
+    """Return (phone_numbers, cp_ids) from an uploaded CSV with a phone and/or cpId column"""
+    text = io.StringIO(uploaded_file.getvalue().decode("utf-8-sig"))
+    reader = csv.DictReader(text)
+    columns = {name.strip().lower(): name for name in (reader.fieldnames or [])}
+    phone_column = columns.get("phonenumber") or columns.get("phone")
+    cp_column = columns.get("cpid")
+    if not phone_column and not cp_column:
+        raise ValueError("CSV needs a 'phonenumber' (or 'phone') and/or a 'cpId' column")
+
+    phone_numbers, cp_ids = [], []
+    for row in reader:
+        phone = (row.get(phone_column) or "").strip() if phone_column else ""
+        cp_id = (row.get(cp_column) or "").strip() if cp_column else ""
+        if phone:
+            phone_numbers.append(standardize_phone_number(phone))
+        elif cp_id:
+            cp_ids.append(cp_id)
+    return list(dict.fromkeys(phone_numbers)), list(dict.fromkeys(cp_ids))
+
+def resolve_agents(phone_numbers, cp_ids):
+    """Look agents up with batched `in` queries; returns (agents by doc id, values not found)"""
+    agents = {}
+    found = set()
+    for field, values in (('phonenumber', phone_numbers), ('cpId', cp_ids)):
+        for start in range(0, len(values), IN_QUERY_LIMIT):
+            chunk = values[start:start + IN_QUERY_LIMIT]
+            for doc in db.collection('agents').where(field, 'in', chunk).stream():
+                agent_data = doc.to_dict()
+                agent_data['id'] = doc.id
+                agents[doc.id] = agent_data
+                found.add(agent_data.get(field))
+    missing = [value for value in phone_numbers + cp_ids if value not in found]
+    return agents, missing
+
+def apply_bulk_action(changes, plan=None, on_progress=None):
+    """Apply the bulk action and drop the touched agents from the lookup cache; returns (committed, failed)"""
+    committed, failed = apply_bulk_changes(db, changes, plan=plan, on_progress=on_progress)
+    for agent_data, _ in changes:
+        if agent_data.get('phonenumber'):
+            invalidate_agent(agent_data['phonenumber'])
+    return committed, failed
+
 def display_agent_info(agent_data, show_credits=True, show_blacklist=True):
     """Display agent information using Streamlit components"""
     # Main agent info container
@@ -356,7 +356,7 @@ if "selected_plan" not in st.session_state:
     st.session_state.selected_plan = None
 
 # Create tabs for different functionalities
-tab1, tab2, tab3 = st.tabs(["📋 Plan Management", "💰 Credit Management", "🚫 Blacklist Management"])
+tab1, tab2, tab3, tab4 = st.tabs(["📋 Plan Management", "💰 Credit Management", "🚫 Blacklist Management", "📦 Bulk Management"])
 
 with tab1:
     st.markdown("## 📋 Plan Management")
@@ -499,6 +499,95 @@ with tab3:
                 else:
                     st.error(message)
 
+with tab4:
+    st.markdown("## 📦 Bulk Management")
+    
+    uploaded_csv = st.file_uploader(
+        "Upload CSV of agents",
+        type=["csv"],
+        key="bulk_csv",
+        help="Needs a 'phonenumber' (or 'phone') and/or a 'cpId' column"
+    )
+    
+    col1, col2 = st.columns([1, 1])
+    with col1:
+        bulk_action = st.radio("Action", ["Change Plan", "Add Credits"], key="bulk_action", horizontal=True)
+    with col2:
+        if bulk_action == "Change Plan":
+            bulk_plan = st.selectbox("Target Plan", list(PLAN_CONFIGS), key="bulk_plan", format_func=str.title)
+            bulk_credits = 0
+        else:
+            bulk_plan = None
+            bulk_credits = st.number_input(
+                "Credits to Add",
+                min_value=-1000,
+                max_value=1000,
+                value=10,
+                key="bulk_credits",
+                help="Negative values remove credits"
+            )
+    
+    if uploaded_csv and st.button("🔍 Preview Changes", use_container_width=True):
+        try:
+            phone_numbers, cp_ids = read_bulk_csv(uploaded_csv)
+            with st.spinner(f"Looking up {len(phone_numbers) + len(cp_ids)} agents..."):
+                agents, missing = resolve_agents(phone_numbers, cp_ids)
+            st.session_state.bulk_changes = build_bulk_changes(agents, bulk_plan, bulk_credits)
+            st.session_state.bulk_credits_delta = bulk_credits
+            st.session_state.bulk_plan_target = bulk_plan
+            st.session_state.bulk_missing = missing
+        except Exception as e:
+            st.session_state.bulk_changes = None
+            st.error(f"Failed to read CSV: {str(e)}")
+    
+    if st.session_state.get("bulk_changes"):
+        changes = st.session_state.bulk_changes
+        missing = st.session_state.get("bulk_missing", [])
+        
+        st.markdown("### Preview")
+        st.dataframe([
+            {
+                "Name": agent_data.get('name', ''),
+                "Phone": agent_data.get('phonenumber', ''),
+                "cpId": agent_data.get('cpId', ''),
+                "Current Plan": agent_data.get('userType', ''),
+                "New Plan": update_data.get('userType', agent_data.get('userType', '')),
+                "Current Credits": agent_data.get('monthlyCredits', 0),
+                "New Credits": (
+                    update_data['monthlyCredits'] if 'userType' in update_data
+                    else agent_data.get('monthlyCredits', 0) + st.session_state.bulk_credits_delta
+                ),
+            }
+            for agent_data, update_data in changes
+        ], use_container_width=True)
+        if missing:
+            st.warning(f"⚠️ {len(missing)} entries not found: {', '.join(missing)}")
+        
+        col1, col2 = st.columns([1, 1])
+        with col1:
+            if st.button(f"✅ Apply to {len(changes)} Agents", type="primary", use_container_width=True):
+                progress = st.progress(0.0, text="Applying changes...")
+                committed, failed = apply_bulk_action(
+                    changes,
+                    plan=st.session_state.get("bulk_plan_target"),
+                    on_progress=lambda done, errors: progress.progress(
+                        (done + errors) / len(changes), text=f"Applied {done} of {len(changes)}"
+                    )
+                )
+                st.session_state.bulk_changes = None
+                if failed:
+                    st.error(
+                        f"Updated {committed} agents, {failed} failed. Check the failed agents' "
+                        "credits before re-running: a timed-out batch may still have been applied."
+                    )
+                else:
+                    st.success(f"Successfully updated {committed} agents")
+        
+        with col2:
+            if st.button("❌ Cancel", key="bulk_cancel", use_container_width=True):
+                st.session_state.bulk_changes = None
+                st.rerun()
+
 # Footer
 st.markdown("---")
 st.markdown("""
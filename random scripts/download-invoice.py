@@ -1,5 +1,10 @@
 import os
 import re
+import json
+import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import google_crc32c
 from urllib.parse import urlparse, unquote
 from google.oauth2 import service_account
 from google.cloud import firestore, storage
@@ -9,6 +14,10 @@ from google.api_core.exceptions import GoogleAPIError
 SERVICE_ACCOUNT_PATH = "masal-db-6cc78-aa35f0672ae1.json"  # ← your JSON key
 DOWNLOAD_DIR = "invoices"
 COLLECTION_NAME = "Invoices"  # exact, case-sensitive
+MAX_WORKERS = int(os.getenv("INVOICE_DOWNLOAD_WORKERS", "8"))
+# Checksums of every downloaded file, so re-runs only fetch invoices that changed
+MANIFEST_PATH = os.path.join(DOWNLOAD_DIR, "manifest.json")
+MANIFEST_SAVE_EVERY = 25
 
 os.makedirs(DOWNLOAD_DIR, exist_ok=True)
 
@@ -55,17 +64,69 @@ def sanitize_filename(name: str):
     # Remove leading/trailing whitespace
     return name.strip()
 
-def download_via_storage(client, bucket_name: str, object_path: str, dest_path: str):
-    """Download file from Google Cloud Storage."""
+# --- MANIFEST ---
+def load_manifest():
     try:
-        bucket = client.bucket(bucket_name)
-        blob = bucket.blob(object_path)
-        blob.download_to_filename(dest_path)
-        print(f"✅ Downloaded via Storage API: {dest_path}")
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not read manifest, local files will be re-verified: {e}")
+        return {}
+
+def save_manifest(manifest):
+    # Write to a temp file first so an interrupted run never leaves a broken manifest
+    temp_path = MANIFEST_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, MANIFEST_PATH)
+
+def file_checksums(path):
+    """Base64 crc32c and md5 of a local file, in the format GCS reports them."""
+    crc = google_crc32c.Checksum()
+    md5 = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            crc.update(chunk)
+            md5.update(chunk)
+    return base64.b64encode(crc.digest()).decode(), base64.b64encode(md5.digest()).decode()
+
+def is_unchanged(blob, dest_path, entry):
+    """True if the local file already matches the blob."""
+    if not os.path.exists(dest_path) or os.path.getsize(dest_path) != blob.size:
+        return False
+    if entry and (entry.get("crc32c"), entry.get("md5_hash")) == (blob.crc32c, blob.md5_hash):
         return True
+    # No (or stale) manifest entry: hash the file itself
+    crc32c, md5_hash = file_checksums(dest_path)
+    return crc32c == blob.crc32c or (blob.md5_hash is not None and md5_hash == blob.md5_hash)
+
+def download_via_storage(client, bucket_name: str, object_path: str, dest_path: str, entry=None):
+    """
+    Download file from Google Cloud Storage unless the local copy is unchanged.
+    Returns (status, manifest entry) with status "downloaded", "skipped" or "failed".
+    """
+    try:
+        blob = client.bucket(bucket_name).get_blob(object_path)
+        if blob is None:
+            print(f"❌ Not found in storage: gs://{bucket_name}/{object_path}")
+            return "failed", None
+        new_entry = {
+            "bucket": bucket_name, "object": object_path, "generation": blob.generation,
+            "size": blob.size, "crc32c": blob.crc32c, "md5_hash": blob.md5_hash
+        }
+        if is_unchanged(blob, dest_path, entry):
+            return "skipped", new_entry
+        # Download next to the target and rename, so an interrupted download never looks complete
+        part_path = dest_path + ".part"
+        blob.download_to_filename(part_path, checksum="crc32c")
+        os.replace(part_path, dest_path)
+        print(f"✅ Downloaded via Storage API: {dest_path}")
+        return "downloaded", new_entry
     except Exception as e:
-        print(f"❌ Storage API error: {e}")
-        return False
+        print(f"❌ Storage API error for {dest_path}: {e}")
+        return "failed", None
 
 def main():
     # 1) Init clients
@@ -102,8 +163,9 @@ def main():
         print("⚠️ No docs found. Check your collection name or filter.")
         return
 
-    # 3) Iterate & download
-    success_count = 0
+    # 3) Work out what to download
+    tasks = []
+    seen_filenames = set()
     failed_count = 0
     
     for doc in docs:
@@ -131,40 +193,65 @@ def main():
         # Create a clean filename
         safe_id = sanitize_filename(str(invoice_id))
         
-        print(f"\n📄 Doc {doc_id} → invoice_id={safe_id!r}")
-        
-        # Debug: print all fields to help identify URL field
-        print(f"   Fields: {', '.join(data.keys())}")
-        
         if not url:
-            print("   ⚠️ Skipping: no file URL found in document")
+            print(f"⚠️ Skipping doc {doc_id} (invoice_id={safe_id!r}): no file URL found. Fields: {', '.join(data.keys())}")
             failed_count += 1
             continue
-            
-        print(f"   URL: {url}")
         
         try:
             # Parse the URL to get bucket and object path
             bucket, obj_path = parse_firebase_storage_url(url)
-            
-            # Get file extension from the object path
-            ext = get_extension_from_path(obj_path)
-            
-            # Create destination filename
-            filename = f"invoice-{safe_id}{ext}"
-            dest = os.path.join(DOWNLOAD_DIR, filename)
-            
-            # Download the file
-            if download_via_storage(stor, bucket, obj_path, dest):
-                success_count += 1
-            else:
-                failed_count += 1
-                
         except Exception as e:
             print(f"❌ Failed for document {doc_id}: {e}")
             failed_count += 1
+            continue
+            
+        # Create destination filename from the object's extension
+        filename = f"invoice-{safe_id}{get_extension_from_path(obj_path)}"
+        if filename in seen_filenames:
+            print(f"⚠️ Skipping doc {doc_id}: {filename} is already downloaded for another document")
+            failed_count += 1
+            continue
+        seen_filenames.add(filename)
+        tasks.append((doc_id, bucket, obj_path, filename))
+
+    # 4) Download in parallel, skipping files whose checksums already match
+    # Workers only download; the manifest is updated here on the main thread as results arrive
+    manifest = load_manifest()
+    success_count = 0
+    skipped_count = 0
+    completed = 0
+    print(f"⬇️ Checking {len(tasks)} invoices with {MAX_WORKERS} workers...")
+    
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = {
+            executor.submit(
+                download_via_storage, stor, bucket, obj_path,
+                os.path.join(DOWNLOAD_DIR, filename), manifest.get(filename)
+            ): (doc_id, filename)
+            for doc_id, bucket, obj_path, filename in tasks
+        }
+        try:
+            for future in as_completed(futures):
+                doc_id, filename = futures[future]
+                status, entry = future.result()
+                if entry:
+                    manifest[filename] = {**entry, "doc_id": doc_id}
+                completed += 1
+                if completed % MANIFEST_SAVE_EVERY == 0:
+                    save_manifest(manifest)
+                if status == "downloaded":
+                    success_count += 1
+                elif status == "skipped":
+                    skipped_count += 1
+                else:
+                    failed_count += 1
+        finally:
+            # Keep progress even when interrupted, so the next run resumes from here
+            executor.shutdown(wait=False, cancel_futures=True)
+            save_manifest(manifest)
 
-    print(f"\n🏁 All done. Downloaded: {success_count}, Failed: {failed_count}")
+    print(f"\n🏁 All done. Downloaded: {success_count}, Unchanged: {skipped_count}, Failed: {failed_count}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,20 +1,6 @@
-import csv
 import firebase_admin
 from firebase_admin import credentials, firestore
-
-def flatten_dict(d, parent_key='', sep='.'):
-    """
-    Flatten nested dict into single level with dot notation keys.
-    Example: {'a': {'b': 1}} -> {'a.b': 1}
-    """
-    items = []
-    for k, v in d.items():
-        new_key = f"{parent_key}{sep}{k}" if parent_key else k
-        if isinstance(v, dict):
-            items.extend(flatten_dict(v, new_key, sep=sep).items())
-        else:
-            items.append((new_key, v))
-    return dict(items)
+from streaming_csv import StreamingCsvExporter, flatten_dict, gzip_requested
 
 # Initialize Firebase Admin SDK
 cred = credentials.Certificate('credentials/acn-resale-inventories-dde03-firebase-adminsdk-ikyw4-1d40de00d3.json')
@@ -24,31 +10,17 @@ firebase_admin.initialize_app(cred, {
 
 db = firestore.client()
 
-def fetch_and_export_all_to_csv(output_csv='payments_full.csv'):
+def fetch_and_export_all_to_csv(output_csv='payments_full.csv', compress=False):
     collection_name = 'payments'
     docs = db.collection(collection_name).stream()
 
-    all_rows = []
-    all_keys = set()
-
-    # Fetch and flatten each doc
-    for doc in docs:
-        data = doc.to_dict()
-        flat_data = flatten_dict(data)
-        all_rows.append(flat_data)
-        all_keys.update(flat_data.keys())
-
-    # Sort keys for consistent column order
-    header = sorted(all_keys)
-
-    with open(output_csv, mode='w', newline='', encoding='utf-8') as f:
-        writer = csv.DictWriter(f, fieldnames=header)
-        writer.writeheader()
-        for row in all_rows:
-            # Write row, missing keys will be empty
-            writer.writerow(row)
+    # Rows are spilled to disk while the header (sorted union of keys) is collected;
+    # missing keys are written empty
+    with StreamingCsvExporter(output_csv, compress=compress) as exporter:
+        for doc in docs:
+            exporter.add(flatten_dict(doc.to_dict()))
 
-    print(f"Exported full payment documents from '{collection_name}' to '{output_csv}'.")
+    print(f"Exported {exporter.rows} full payment documents from '{collection_name}' to '{exporter.output_path}'.")
 
 if __name__ == "__main__":
-    fetch_and_export_all_to_csv()
+    fetch_and_export_all_to_csv(compress=gzip_requested())
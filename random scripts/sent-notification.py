@@ -1,7 +1,23 @@
+import os
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import firebase_admin
 from firebase_admin import credentials, messaging, firestore
 from firebase_admin.exceptions import FirebaseError
 
+NOTIFICATION_TITLE = '🔔 Deal Maker Alert'
+NOTIFICATION_BODY = '‘Make every click count.’ Browse listings, engage leads, and close deals fast.'
+
+FCM_BATCH_SIZE = 500           # send_each limit
+FCM_CONCURRENCY = int(os.getenv('FCM_CONCURRENCY', '4'))
+FCM_MESSAGES_PER_SECOND = float(os.getenv('FCM_MESSAGES_PER_SECOND', '2000'))  # 0 = unlimited
+WRITE_BATCH_SIZE = 500         # Firestore batch limit
+SEGMENT_CACHE_PATH = os.getenv('SEGMENT_CACHE_PATH', '.segment-cache.json')
+SEGMENT_CACHE_TTL_SECONDS = float(os.getenv('SEGMENT_CACHE_TTL_SECONDS', '300'))  # 0 = no cache
+
 # 1) Init app once
 cred = credentials.Certificate('credentials/acn-resale-inventories-dde03-firebase-adminsdk-ikyw4-1d40de00d3.json')
 firebase_admin.initialize_app(cred)
@@ -9,70 +25,231 @@ firebase_admin.initialize_app(cred)
 # 2) Firestore client
 db = firestore.client()
 
-def get_all_fsm_tokens():
+def extract_tokens(doc):
     """
-    Returns a list of tuples (doc_ref, token, is_array) for every fsmToken found.
+    Returns a list of tuples (doc_ref, token, is_array) for the fsmToken of one agent.
     - is_array=True if the original field was a list, False if it was a single string.
     """
     results = []
-    agents = db.collection('agents').stream()
-    for doc in agents:
-        data = doc.to_dict()
-        raw = data.get('fsmToken')
-        doc_ref = doc.reference
-
-        if isinstance(raw, str) and raw.strip():
-            # single string token
-            results.append((doc_ref, raw.strip(), False))
-        elif isinstance(raw, (list, tuple)):
-            # multiple tokens in an array
-            for t in raw:
-                if isinstance(t, str) and t.strip():
-                    results.append((doc_ref, t.strip(), True))
-        # else: skip missing / invalid types
+    raw = (doc.to_dict() or {}).get('fsmToken')
+    doc_ref = doc.reference
+
+    if isinstance(raw, str) and raw.strip():
+        # single string token
+        results.append((doc_ref, raw.strip(), False))
+    elif isinstance(raw, (list, tuple)):
+        # multiple tokens in an array
+        for t in raw:
+            if isinstance(t, str) and t.strip():
+                results.append((doc_ref, t.strip(), True))
+    # else: skip missing / invalid types
+
+    return results
+
+# ---------------------------
+# Segments: which agents a campaign goes to
+# ---------------------------
+# A segment is (userType, kam, expiring_within_days); None means "any". Filters run
+# as Firestore queries and only fsmToken is read, so a targeted send never scans
+# the whole agents collection. Resolved token lists are cached per segment in
+# SEGMENT_CACHE_PATH for SEGMENT_CACHE_TTL_SECONDS, so repeated sends to the same
+# audience from separate runs reuse them; pruning dead tokens clears the cache.
+#
+# --expiring-within combined with --user-type and/or --kam is a range filter plus
+# equality filters, which needs a composite index on agents: (userType, planExpiry),
+# (kam, planExpiry) or (userType, kam, planExpiry). They are defined in
+# firestore.indexes.json at the repo root; deploy them with
+# `firebase deploy --only firestore:indexes` before the first such send,
+# otherwise the query fails with FAILED_PRECONDITION.
+
+def segment_query(user_type=None, kam=None, expiring_within_days=None):
+    query = db.collection('agents')
+    if user_type:
+        query = query.where('userType', '==', user_type)
+    if kam:
+        query = query.where('kam', '==', kam)
+    if expiring_within_days is not None:
+        # planExpiry is stored in unix seconds
+        now = int(time.time())
+        query = query.where('planExpiry', '>=', now).where('planExpiry', '<=', now + int(expiring_within_days) * 86400)
+    return query.select(['fsmToken'])
+
+def load_segment_cache():
+    try:
+        with open(SEGMENT_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not read {SEGMENT_CACHE_PATH}, ignoring it: {e}")
+        return {}
+
+def save_segment_cache(cache):
+    # Write to a temp file first so an interrupted run never leaves a broken cache
+    temp_path = SEGMENT_CACHE_PATH + '.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(cache, f)
+    os.replace(temp_path, SEGMENT_CACHE_PATH)
+
+def invalidate_segment_cache():
+    try:
+        os.remove(SEGMENT_CACHE_PATH)
+    except FileNotFoundError:
+        pass
+
+def get_segment_tokens(user_type=None, kam=None, expiring_within_days=None, use_cache=True):
+    """(doc_ref, token, is_array) tuples for every agent in the segment, cached per segment."""
+    key = json.dumps([user_type, kam, expiring_within_days])
+    cache = load_segment_cache() if use_cache and SEGMENT_CACHE_TTL_SECONDS > 0 else {}
+    cached = cache.get(key)
+    if cached and time.time() - cached['fetched_at'] < SEGMENT_CACHE_TTL_SECONDS:
+        print(f"✅ Using cached tokens for segment {key}")
+        return [(db.document(path), token, is_array) for path, token, is_array in cached['tokens']]
+
+    results = []
+    for doc in segment_query(user_type, kam, expiring_within_days).stream():
+        results.extend(extract_tokens(doc))
 
+    if SEGMENT_CACHE_TTL_SECONDS > 0:
+        # Drop expired segments while we're here
+        cache = {
+            cached_key: entry for cached_key, entry in load_segment_cache().items()
+            if time.time() - entry['fetched_at'] < SEGMENT_CACHE_TTL_SECONDS
+        }
+        cache[key] = {
+            'fetched_at': time.time(),
+            'tokens': [[doc_ref.path, token, is_array] for doc_ref, token, is_array in results]
+        }
+        save_segment_cache(cache)
     return results
 
-def send_and_prune_tokens():
-    pairs = get_all_fsm_tokens()
-    print(f"Found {len(pairs)} token entries, attempting sends…")
+def get_all_fsm_tokens():
+    """Tokens of every agent (the empty segment)."""
+    return get_segment_tokens()
+
+def chunked(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+class RateLimiter:
+    """Thread-safe limiter: acquire(n) blocks until n more messages fit in the per-second budget."""
+
+    def __init__(self, per_second):
+        self.interval = 1.0 / per_second if per_second > 0 else 0
+        self.next_time = time.monotonic()
+        self.lock = threading.Lock()
 
-    for doc_ref, token, is_array in pairs:
-        msg = messaging.Message(
+    def acquire(self, count=1):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_time)
+            self.next_time = start + count * self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def is_dead_token_error(error):
+    """True for the "token not registered / not found" family of FCM errors."""
+    if isinstance(error, messaging.UnregisteredError):
+        return True
+    code = getattr(error, 'code', '') or ''
+    return 'registration-token' in code or code == 'NOT_FOUND'
+
+def send_batch(batch, limiter):
+    """Send one batch with send_each; returns (sent, dead (doc_ref, token, is_array) entries, errors)."""
+    messages = [
+        messaging.Message(
             token=token,
-            notification=messaging.Notification(
-                title='🔔 Deal Maker Alert',
-                body='‘Make every click count.’ Browse listings, engage leads, and close deals fast.'
-            )
+            notification=messaging.Notification(title=NOTIFICATION_TITLE, body=NOTIFICATION_BODY)
         )
-        try:
-            resp = messaging.send(msg)
-            print(f'✅ Sent to {token[:8]}…: {resp}')
-
-        except FirebaseError as e:
-            code = getattr(e, 'code', '')
-            # if it's the “token not registered / not found” family of errors:
-            if 'registration-token' in code or code == 'NOT_FOUND':
-                if is_array:
-                    # remove just this token from the array
-                    doc_ref.update({
-                        'fsmToken': firestore.ArrayRemove([token])
-                    })
-                    print(f'🗑 Removed expired token {token[:8]}… from array in {doc_ref.id}')
-                else:
-                    # it was a single string—delete the whole field
-                    doc_ref.update({
-                        'fsmToken': firestore.DELETE_FIELD
-                    })
-                    print(f'🗑 Deleted fsmToken field from {doc_ref.id}')
-            else:
-                # some other FCM error—log and move on
-                print(f'⚠️ Skipped {token[:8]}… — {code}: {e}')
+        for _, token, _ in batch
+    ]
+    limiter.acquire(len(messages))
+    response = messaging.send_each(messages)
+    dead = []
+    errors = 0
+    for entry, result in zip(batch, response.responses):
+        if result.success:
+            continue
+        if is_dead_token_error(result.exception):
+            dead.append(entry)
+        else:
+            errors += 1
+            print(f'⚠️ Skipped {entry[1][:8]}… — {getattr(result.exception, "code", "")}: {result.exception}')
+    return response.success_count, dead, errors
 
+def prune_tokens(dead):
+    """
+    Remove dead tokens with batched writes: one update per agent document. A failed
+    batch is reported and skipped; returns the number of agents left unpruned.
+    """
+    removals = {}
+    for doc_ref, token, is_array in dead:
+        entry = removals.setdefault(doc_ref.path, {'ref': doc_ref, 'tokens': [], 'delete_field': False})
+        if is_array:
+            # remove just this token from the array
+            entry['tokens'].append(token)
+        else:
+            # it was a single string—delete the whole field
+            entry['delete_field'] = True
+
+    updates = list(removals.values())
+    failed = 0
+    for chunk in chunked(updates, WRITE_BATCH_SIZE):
+        batch = db.batch()
+        for entry in chunk:
+            value = firestore.DELETE_FIELD if entry['delete_field'] else firestore.ArrayRemove(entry['tokens'])
+            batch.update(entry['ref'], {'fsmToken': value})
+        try:
+            batch.commit()
         except Exception as e:
-            # catch-all so nothing stalls the loop
-            print(f'❌ Unexpected error sending to {token[:8]}… — {e}')
+            # e.g. an agent deleted since the send (NOT_FOUND fails the whole batch); keep going
+            print(f'❌ Pruning a batch of {len(chunk)} agents failed — {e}')
+            failed += len(chunk)
+    # Cached segments may still hold the pruned tokens
+    invalidate_segment_cache()
+    print(f'🗑 Pruned expired tokens from {len(updates) - failed} of {len(updates)} agents')
+    return failed
+
+def send_and_prune_tokens(user_type=None, kam=None, expiring_within_days=None, use_cache=True):
+    pairs = get_segment_tokens(user_type, kam, expiring_within_days, use_cache=use_cache)
+    print(f"Found {len(pairs)} token entries, sending in batches of {FCM_BATCH_SIZE}…")
+
+    limiter = RateLimiter(FCM_MESSAGES_PER_SECOND)
+    sent = 0
+    errors = 0
+    dead = []
+    with ThreadPoolExecutor(max_workers=FCM_CONCURRENCY) as executor:
+        futures = {executor.submit(send_batch, batch, limiter): batch for batch in chunked(pairs, FCM_BATCH_SIZE)}
+        for future in as_completed(futures):
+            batch = futures[future]
+            try:
+                batch_sent, batch_dead, batch_errors = future.result()
+            except FirebaseError as e:
+                print(f'⚠️ Batch of {len(batch)} failed — {getattr(e, "code", "")}: {e}')
+                errors += len(batch)
+                continue
+            except Exception as e:
+                # catch-all so one bad batch doesn't stop the broadcast
+                print(f'❌ Unexpected error sending a batch of {len(batch)} — {e}')
+                errors += len(batch)
+                continue
+            sent += batch_sent
+            errors += batch_errors
+            dead.extend(batch_dead)
+            print(f'✅ Batch done: {batch_sent}/{len(batch)} sent, {len(batch_dead)} expired tokens')
+
+    prune_failed = prune_tokens(dead) if dead else 0
+    print(f'🏁 Sent {sent}, expired {len(dead)}, failed {errors}, agents left unpruned {prune_failed}')
 
 
 if __name__ == '__main__':
-    send_and_prune_tokens()
+    parser = argparse.ArgumentParser(description='Send the Deal Maker notification to a segment of agents.')
+    parser.add_argument('--user-type', help='only agents with this userType (e.g. trial, premium)')
+    parser.add_argument('--kam', help="only this KAM's agents")
+    parser.add_argument('--expiring-within', type=int, metavar='DAYS',
+                        help='only agents whose planExpiry falls within the next DAYS days')
+    parser.add_argument('--no-cache', action='store_true', help='re-read the segment instead of using cached tokens')
+    args = parser.parse_args()
+    send_and_prune_tokens(args.user_type, args.kam, args.expiring_within, use_cache=not args.no_cache)
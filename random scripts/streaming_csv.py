@@ -0,0 +1,119 @@
+import os
+import csv
+import sys
+import gzip
+import json
+import tempfile
+
+# ---------------------------
+# Two-phase streaming CSV export
+# ---------------------------
+# Phase 1: every row is appended as one JSON line to a temporary spill file
+# while the union of its keys is collected. Phase 2: once the header is known,
+# the spill file is read back line by line into the CSV. Only the key set is
+# held in memory, so exporting a large collection uses constant memory.
+# When the columns are fixed up front, rows go straight to the CSV.
+#
+# The CSV is written next to the target as <name>.tmp and renamed when done,
+# so an interrupted export never leaves a truncated file behind. Pass
+# compress=True (or use a .gz path) to write it gzip-compressed.
+
+CSV_GZIP = os.getenv("CSV_GZIP", "0") == "1"
+
+def gzip_requested(argv=None):
+    return CSV_GZIP or "--gzip" in (sys.argv if argv is None else argv)
+
+def flatten_dict(d, parent_key='', sep='.'):
+    """
+    Flatten nested dict into single level with `sep`-joined keys.
+    Example: {'a': {'b': 1}} -> {'a.b': 1}
+    """
+    items = {}
+    for k, v in d.items():
+        new_key = f"{parent_key}{sep}{k}" if parent_key else k
+        if isinstance(v, dict):
+            items.update(flatten_dict(v, new_key, sep=sep))
+        else:
+            items[new_key] = v
+    return items
+
+class StreamingCsvExporter:
+    """
+    Collects rows with add() and writes them to `output_path` on close().
+    Without `fieldnames` the header is every key seen, sorted.
+    """
+
+    def __init__(self, output_path, fieldnames=None, compress=False):
+        if compress and not output_path.endswith(".gz"):
+            output_path += ".gz"
+        self.output_path = output_path
+        self.compress = output_path.endswith(".gz")
+        self.temp_path = output_path + ".tmp"
+        self.fieldnames = list(fieldnames) if fieldnames else None
+        self.keys = set()
+        self.rows = 0
+        self.spill = None
+        self.csv_file = None
+        self.closed = False
+        if self.fieldnames:
+            self.csv_file, self.writer = self._open_csv(self.fieldnames)
+        else:
+            self.spill = tempfile.TemporaryFile(mode="w+", encoding="utf-8")
+
+    def _open_csv(self, fieldnames):
+        if self.compress:
+            f = gzip.open(self.temp_path, "wt", newline="", encoding="utf-8")
+        else:
+            f = open(self.temp_path, "w", newline="", encoding="utf-8")
+        writer = csv.DictWriter(f, fieldnames=fieldnames, extrasaction="ignore")
+        writer.writeheader()
+        return f, writer
+
+    def add(self, row):
+        if self.spill is None:
+            self.writer.writerow(row)
+        else:
+            self.keys.update(row.keys())
+            # default=str writes values JSON can't hold the way csv would print them
+            self.spill.write(json.dumps(row, ensure_ascii=False, default=str) + "\n")
+        self.rows += 1
+
+    def close(self):
+        """Write out the CSV and move it into place; returns the number of rows."""
+        if self.spill is not None:
+            self.fieldnames = sorted(self.keys)
+            self.csv_file, self.writer = self._open_csv(self.fieldnames)
+            self.spill.seek(0)
+            for line in self.spill:
+                self.writer.writerow(json.loads(line))
+            self.spill.close()
+            self.spill = None
+        self.csv_file.close()
+        self.csv_file = None
+        os.replace(self.temp_path, self.output_path)
+        self.closed = True
+        return self.rows
+
+    def abort(self):
+        """Drop everything written so far, leaving any previous export untouched."""
+        if self.spill is not None:
+            self.spill.close()
+            self.spill = None
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+        self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.closed:
+            return False
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
@@ -1,4 +1,5 @@
 import csv
+import time
 import firebase_admin
 from firebase_admin import credentials, firestore
 
@@ -8,7 +9,15 @@ firebase_admin.initialize_app(cred)
 
 db = firestore.client()
 
-def update_kam_for_agents(csv_path):
+IN_QUERY_LIMIT = 30     # max values in an 'in' / 'array_contains_any' filter
+WRITE_BATCH_SIZE = 500  # Firestore batch limit
+
+def chunked(items, size):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+def read_assignments(csv_path):
     # Read CSV into a dict: cpId -> kam
     updates = {}
     with open(csv_path, newline='') as csvfile:
@@ -16,56 +25,111 @@ def update_kam_for_agents(csv_path):
         for row in reader:
             cp_id = row['cpId'].strip()
             kam_id = row['kam'].strip()
-            updates[cp_id] = kam_id
+            if cp_id and kam_id:
+                updates[cp_id] = kam_id
+    return updates
 
-    # Step 1: Update agents collection kam field
-    for cp_id, new_kam in updates.items():
-        agents_ref = db.collection('agents')
-        # Query agent doc with cpId
-        query = agents_ref.where('cpId', '==', cp_id).limit(1).stream()
-        agent_doc = None
-        for doc in query:
-            agent_doc = doc
-            break
-        if agent_doc:
-            # Update kam field
-            agent_doc.reference.update({'kam': new_kam})
-            print(f'Updated kam for agent {cp_id} to {new_kam}')
-        else:
-            print(f'Agent with cpId {cp_id} not found')
-
-    # Step 2: Remove cpId from all myAgents arrays in kam collection
+def resolve_agents(cp_ids):
+    """cpId -> (doc_ref, current kam), looked up with batched 'in' queries."""
+    agents = {}
+    agents_ref = db.collection('agents')
+    for chunk in chunked(cp_ids, IN_QUERY_LIMIT):
+        for doc in agents_ref.where('cpId', 'in', chunk).select(['cpId', 'kam']).stream():
+            data = doc.to_dict()
+            agents.setdefault(data.get('cpId'), (doc.reference, data.get('kam')))
+    return agents
+
+def find_kams_listing(cp_ids):
+    """kam id -> set of the given cpIds currently in its myAgents array."""
+    listed = {}
     kam_ref = db.collection('kam')
-    # Get all kam documents
-    all_kam_docs = kam_ref.stream()
-    for kam_doc in all_kam_docs:
-        doc_ref = kam_doc.reference
-        data = kam_doc.to_dict()
-        if 'myAgents' in data:
-            my_agents = data['myAgents']
-            # Find all cpIds to remove from this document's myAgents array
-            to_remove = [cp for cp in updates.keys() if cp in my_agents]
-            if to_remove:
-                # Remove them
-                updated_agents = [agent for agent in my_agents if agent not in to_remove]
-                doc_ref.update({'myAgents': updated_agents})
-                print(f'Removed {to_remove} from kam doc {kam_doc.id}')
-
-    # Step 3: Add cpId to the new kam's myAgents array
+    wanted = set(cp_ids)
+    for chunk in chunked(cp_ids, IN_QUERY_LIMIT):
+        query = kam_ref.where('myAgents', 'array_contains_any', chunk).select(['myAgents'])
+        for kam_doc in query.stream():
+            my_agents = set((kam_doc.to_dict() or {}).get('myAgents') or [])
+            listed.setdefault(kam_doc.id, set()).update(my_agents & wanted)
+    return listed
+
+def plan_reassignment(updates, agents, listed):
+    """
+    Work out every write as sets: which agents change kam, which cpIds leave which
+    kam's myAgents and which join. Returns {cpId: (new kam or None, kams to leave,
+    kam to join or None)} for every agent that needs at least one write.
+    """
+    leaving = {}
+    for kam_id, cp_ids in listed.items():
+        for cp_id in cp_ids:
+            if cp_id in agents and updates[cp_id] != kam_id:
+                leaving.setdefault(cp_id, set()).add(kam_id)
+
+    plan = {}
     for cp_id, new_kam in updates.items():
-        kam_doc_ref = kam_ref.document(new_kam)
-        kam_doc = kam_doc_ref.get()
-        if kam_doc.exists:
-            data = kam_doc.to_dict()
-            my_agents = data.get('myAgents', [])
-            if cp_id not in my_agents:
-                my_agents.append(cp_id)
-                kam_doc_ref.update({'myAgents': my_agents})
-                print(f'Added {cp_id} to myAgents of kam {new_kam}')
-        else:
-            # If the kam doc doesn't exist, optionally create it
-            kam_doc_ref.set({'myAgents': [cp_id]})
-            print(f'Created kam doc {new_kam} and added {cp_id}')
+        if cp_id not in agents:
+            continue
+        agent_kam = new_kam if agents[cp_id][1] != new_kam else None
+        joining = new_kam if cp_id not in listed.get(new_kam, set()) else None
+        leaves = leaving.get(cp_id, set())
+        if agent_kam or joining or leaves:
+            plan[cp_id] = (agent_kam, leaves, joining)
+    return plan
+
+def agent_operations(cp_id, agent_ref, change, now):
+    """All writes for one agent: its kam field and its entry in every kam's myAgents."""
+    agent_kam, leaves, joining = change
+    kam_ref = db.collection('kam')
+    operations = []
+    if agent_kam:
+        operations.append(('update', agent_ref, {'kam': agent_kam, 'lastModified': now}, {}))
+    for kam_id in sorted(leaves):
+        operations.append(('update', kam_ref.document(kam_id),
+                           {'myAgents': firestore.ArrayRemove([cp_id]), 'lastModified': now}, {}))
+    if joining:
+        # set(merge=True) also creates kam docs that don't exist yet
+        operations.append(('set', kam_ref.document(joining),
+                           {'myAgents': firestore.ArrayUnion([cp_id]), 'lastModified': now}, {'merge': True}))
+    return operations
+
+def pack_groups(groups, size=WRITE_BATCH_SIZE):
+    """Pack per-agent operation groups into batches of at most `size`, never splitting a group."""
+    batch = []
+    for group in groups:
+        if batch and len(batch) + len(group) > size:
+            yield batch
+            batch = []
+        batch.extend(group)
+    if batch:
+        yield batch
+
+def commit_operations(groups):
+    committed = 0
+    for chunk in pack_groups(groups):
+        batch = db.batch()
+        for method, doc_ref, data, kwargs in chunk:
+            getattr(batch, method)(doc_ref, data, **kwargs)
+        batch.commit()
+        committed += len(chunk)
+        print(f'Committed a batch of {len(chunk)} writes.')
+    return committed
+
+def update_kam_for_agents(csv_path):
+    updates = read_assignments(csv_path)
+    print(f'🔍 {len(updates)} assignments in {csv_path}')
+
+    agents = resolve_agents(updates.keys())
+    for cp_id in updates.keys() - agents.keys():
+        print(f'Agent with cpId {cp_id} not found')
+
+    listed = find_kams_listing(list(agents.keys()))
+    plan = plan_reassignment(updates, agents, listed)
+
+    # Each agent's writes (its kam field, ArrayRemove from old kams, ArrayUnion into
+    # the new one) go in the same batch, so an agent and its kam lists change together.
+    # lastModified is bumped so delta syncs and the snapshot cache pick the change up.
+    now = int(time.time())
+    groups = [agent_operations(cp_id, agents[cp_id][0], change, now) for cp_id, change in sorted(plan.items())]
+    writes = commit_operations(groups)
+    print(f'✅ Reassigned {len(plan)} agents with {writes} writes')
 
 if __name__ == '__main__':
     csv_path = 'random scripts/Untitled spreadsheet - Sheet1 (6).csv'
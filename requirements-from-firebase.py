@@ -1,28 +1,17 @@
 import os
-import math
-import firebase_admin
-from firebase_admin import credentials, firestore
-import gspread
-from google.oauth2.service_account import Credentials
-from datetime import datetime, timezone
 from dotenv import load_dotenv
+import pandas as pd
+import pyarrow as pa
 import sys, codecs
-
-# Ensure UTF-8 output
-sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+from snapshot_cache import read_through
+from sheets_writer import write_sheet_diff
+from clients import get_firebase_app, get_firestore_client, get_sheets_service
+from transforms import records_to_frame, format_unix_dates, dict_field, scrub
+from parquet_export import parquet_requested, export_collection
 
 # Load environment variables
 load_dotenv()
 
-# ---------------------------
-# Firebase Configuration
-# ---------------------------
-FIREBASE_PROJECT_ID       = os.getenv("FIREBASE_PROJECT_ID")
-FIREBASE_PRIVATE_KEY_ID   = os.getenv("FIREBASE_PRIVATE_KEY_ID")
-FIREBASE_PRIVATE_KEY      = os.getenv("FIREBASE_PRIVATE_KEY", "").replace('\\n', '\n')
-FIREBASE_CLIENT_EMAIL     = os.getenv("FIREBASE_CLIENT_EMAIL")
-FIREBASE_CLIENT_ID        = os.getenv("FIREBASE_CLIENT_ID")
-
 # ---------------------------
 # Google Sheets Configuration
 # ---------------------------
@@ -39,85 +28,63 @@ FIRESTORE_COLLECTION_NAME = os.getenv("FIRESTORE_REQUIREMENTS_COLLECTION_NAME",
 # ---------------------------
 def initialize_firebase():
     try:
-        cred_data = {
-            "type": "service_account",
-            "project_id": FIREBASE_PROJECT_ID,
-            "private_key_id": FIREBASE_PRIVATE_KEY_ID,
-            "private_key": FIREBASE_PRIVATE_KEY,
-            "client_email": FIREBASE_CLIENT_EMAIL,
-            "client_id": FIREBASE_CLIENT_ID,
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{FIREBASE_CLIENT_EMAIL.replace('@', '%40')}"
-        }
-        cred = credentials.Certificate(cred_data)
-        firebase_admin.initialize_app(cred)
-        print("✅ Firebase initialized successfully.")
+        get_firebase_app()
     except Exception as e:
         print(f"❌ Error initializing Firebase: {e}")
 
 # ---------------------------
-# Convert Unix timestamp to readable date
+# Sheet columns, in order: plain fields, dates and budget bounds
 # ---------------------------
-def convert_unix_to_date(unix_timestamp):
-    try:
-        if not unix_timestamp:
-            return ""
-        return datetime.fromtimestamp(int(unix_timestamp), tz=timezone.utc).strftime('%d/%b/%Y')
-    except Exception as e:
-        print(f"⚠️ Error converting timestamp {unix_timestamp}: {e}")
-        return ""
+COLUMN_FIELDS = [
+    "requirementId", "agentCpid", "propertyName", "assetType", "configuration",
+    "added", "lastModified", "area", "budget.from", "budget.to",
+    "marketValue", "requirementDetails", "status"
+]
+DATE_FIELDS = ["added", "lastModified"]
+
+# Only the fields behind the columns are read from Firestore ("budget.from" selects just that subfield)
+SELECT_FIELDS = list(dict.fromkeys(COLUMN_FIELDS))
+
+# Arrow types for the Parquet export; other columns are inferred
+PARQUET_TYPES = {"budget": pa.struct([("from", pa.float64()), ("to", pa.float64())])}
 
 # ---------------------------
-# Sanitize strings (remove leading apostrophes)
+# Transform documents into sheet rows, column by column
 # ---------------------------
-def sanitize_str(value):
-    if isinstance(value, str):
-        return value.lstrip("'")
-    return str(value)
+def build_requirement_rows(records):
+    frame = records_to_frame(records, [f for f in COLUMN_FIELDS if "." not in f] + ["budget"])
+    columns = {}
+    for field in COLUMN_FIELDS:
+        if field in DATE_FIELDS:
+            columns[field] = format_unix_dates(frame[field], '%d/%b/%Y')
+        elif field.startswith("budget."):
+            columns[field] = dict_field(frame["budget"], field.split(".", 1)[1])
+        else:
+            columns[field] = frame[field]
+    # Remove leading apostrophes so Sheets doesn't keep values as text
+    rows = scrub(pd.DataFrame(columns, columns=COLUMN_FIELDS))
+    rows = rows.apply(lambda column: column.str.lstrip("'"))
+    return rows.values.tolist()
 
 # ---------------------------
 # Fetch data from Firestore requirements collection
 # ---------------------------
 def fetch_requirements_data(collection_name):
     try:
-        db = firestore.client()
+        db = get_firestore_client()
         print(f"🔍 Fetching Firestore collection: {collection_name}")
-        docs = list(db.collection(collection_name).stream())
-        if not docs:
+        docs = read_through(db.collection(collection_name), fields=SELECT_FIELDS)
+        records = [doc.to_dict() or {} for doc in docs]
+        if not records:
             print("⚠️ No documents found in Firestore.")
             return []
 
-        print(f"📄 Found {len(docs)} documents.")
-        rows = []
-        for doc in docs:
-            try:
-                item = doc.to_dict()
-                budget = item.get("budget", {}) or {}
-                row = [
-                    sanitize_str(item.get("requirementId", "")),
-                    sanitize_str(item.get("agentCpid", "")),
-                    sanitize_str(item.get("propertyName", "")),
-                    sanitize_str(item.get("assetType", "")),
-                    sanitize_str(item.get("configuration", "")),
-                    sanitize_str(convert_unix_to_date(item.get("added"))),
-                    sanitize_str(convert_unix_to_date(item.get("lastModified"))),
-                    sanitize_str(item.get("area", "")),
-                    sanitize_str(budget.get("from", "")),
-                    sanitize_str(budget.get("to", "")),
-                    sanitize_str(item.get("marketValue", "")),
-                    sanitize_str(item.get("requirementDetails", "")),
-                    sanitize_str(item.get("status", ""))
-                ]
-                rows.append(row)
-            except Exception as doc_err:
-                print(f"⚠️ Error processing document {doc.id}: {doc_err}")
+        rows = build_requirement_rows(records)
         print(f"✅ Successfully fetched {len(rows)} records.")
         return rows
     except Exception as e:
         print(f"❌ Error fetching data from Firestore: {e}")
-        return []
+        return None
 
 # ---------------------------
 # Write data to Google Sheet
@@ -126,58 +93,53 @@ def write_to_google_sheet(data):
     try:
         if not data:
             print("⚠️ No data to write to Google Sheets.")
-            return
-
-        creds_data = {
-            "type": "service_account",
-            "project_id": os.getenv("GSPREAD_PROJECT_ID"),
-            "private_key_id": os.getenv("GSPREAD_PRIVATE_KEY_ID"),
-            "private_key": os.getenv("GSPREAD_PRIVATE_KEY", "").replace('\\n', '\n'),
-            "client_email": os.getenv("GSPREAD_CLIENT_EMAIL"),
-            "client_id": os.getenv("GSPREAD_CLIENT_ID"),
-            "auth_uri": "https://accounts.google.com/o/oauth2/auth",
-            "token_uri": "https://oauth2.googleapis.com/token",
-            "auth_provider_x509_cert_url": "https://www.googleapis.com/oauth2/v1/certs",
-            "client_x509_cert_url": f"https://www.googleapis.com/robot/v1/metadata/x509/{os.getenv('GSPREAD_CLIENT_EMAIL').replace('@', '%40')}"
-        }
-        scopes = ['https://www.googleapis.com/auth/spreadsheets']
-        creds = Credentials.from_service_account_info(creds_data, scopes=scopes)
-        gc = gspread.authorize(creds)
-        print("✅ Google Sheets API authenticated.")
+            return True
 
-        sheet = gc.open_by_key(GOOGLE_SHEET_ID).worksheet(SHEET_NAME)
-        print(f"✅ Opened sheet '{SHEET_NAME}'.")
+        service = get_sheets_service()
+        print("✅ Google Sheets API authenticated.")
 
         headers = [
             "Requirement ID", "Agent CP ID", "Property Name", "Asset Type", "Configuration",
             "Added Date", "Last Modified Date", "Area", "Budget From", "Budget To",
             "Market Value", "Requirement Details", "Status"
         ]
-        payload = [headers] + data
-
-        sanitized = []
-        for row in payload:
-            sanitized_row = [cell if cell != "nan" else "" for cell in row]
-            sanitized.append(sanitized_row)
 
-        sheet.clear()
-        print("✅ Sheet cleared.")
+        # Only changed rows are sent, matched on Requirement ID.
         # Use USER_ENTERED so dates and numbers are parsed
-        sheet.update("A1", sanitized, value_input_option='USER_ENTERED')
+        write_sheet_diff(
+            service, GOOGLE_SHEET_ID, SHEET_NAME, headers, data, "Requirement ID",
+            value_input_option='USER_ENTERED'
+        )
         print("✅ Data written successfully.")
+        return True
     except Exception as e:
         print(f"❌ Error writing to Google Sheets: {e}")
+        return False
 
 # ---------------------------
 # Main
 # ---------------------------
-def main():
+def main(argv=None):
+    """Run the sync; returns True on success, False if any step failed."""
+    argv = sys.argv[1:] if argv is None else argv
     initialize_firebase()
     data = fetch_requirements_data(FIRESTORE_COLLECTION_NAME)
+    if data is None:
+        return False
+    ok = True
     if data:
-        write_to_google_sheet(data)
+        ok = write_to_google_sheet(data)
     else:
         print("⚠️ No data to write.")
+    if parquet_requested(argv):
+        path = export_collection(
+            get_firestore_client().collection(FIRESTORE_COLLECTION_NAME), PARQUET_TYPES, DATE_FIELDS,
+            fields=SELECT_FIELDS
+        )
+        ok = ok and path is not None
+    return ok
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # Ensure UTF-8 output
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,147 @@
+import os
+import sys
+import json
+import time
+import random
+import shlex
+import codecs
+import signal
+from dotenv import load_dotenv
+from job_runner import JobRunner
+
+# ---------------------------
+# Scheduler daemon for the periodic sync jobs
+# ---------------------------
+# Runs each exporter every N seconds/minutes/hours on the shared job runner.
+# The runner's per-script lock keeps a slow run from overlapping itself (also
+# across scheduler processes and manual runs from the dashboard), random jitter
+# spreads the runs so they don't all hit the Sheets API at once, and last-run
+# times are persisted so a restart picks up the existing cadence instead of
+# running everything immediately.
+#
+# Intervals are set with SYNC_SCHEDULE_<JOB> (e.g. SYNC_SCHEDULE_AGENTS=15m);
+# "off" disables a job. Command-line arguments are set with SYNC_ARGS_<JOB>
+# (e.g. SYNC_ARGS_INVENTORIES="--parquet"); an empty value runs the script bare.
+
+load_dotenv()
+
+STATE_FILE     = os.getenv("SCHEDULER_STATE_FILE", "scheduler-state.json")
+JITTER_SECONDS = float(os.getenv("SCHEDULER_JITTER_SECONDS", "60"))
+TICK_SECONDS   = 5
+
+# name -> (script, default arguments, default interval)
+JOBS = {
+    # Frequent incremental patches, plus a daily full sync that also drops deleted agents
+    "agents": ("agents-from-firebase.py", ["--incremental"], "15m"),
+    "agents-full": ("agents-from-firebase.py", [], "1d"),
+    "inventories": ("inventories-from-firebase.py", [], "1h"),
+    "enquiries": ("enquires-from-firebase.py", [], "15m"),
+    "requirements": ("requirements-from-firebase.py", [], "1h"),
+}
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+def parse_interval(value):
+    """'90s', '15m', '2h', '1d' or plain seconds -> seconds; 'off' -> None."""
+    value = str(value).strip().lower()
+    if value in ("", "off", "none", "0"):
+        return None
+    if value[-1] in UNITS:
+        return float(value[:-1]) * UNITS[value[-1]]
+    return float(value)
+
+def load_state():
+    try:
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Could not read {STATE_FILE}, starting fresh: {e}")
+        return {}
+
+def save_state(state):
+    # Write to a temp file first so a crash never leaves half a state file
+    temp_path = STATE_FILE + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(temp_path, STATE_FILE)
+
+def next_run_time(last_started, interval, now):
+    """Keep the previous cadence after a restart; jobs that never ran start within the jitter window."""
+    jitter = random.uniform(0, JITTER_SECONDS)
+    if last_started is None:
+        return now + jitter
+    return max(last_started + interval, now) + jitter
+
+class Scheduler:
+    def __init__(self, jobs=JOBS, runner=None):
+        self.runner = runner or JobRunner()
+        self.state = load_state()
+        self.intervals = {}
+        self.next_runs = {}
+        self.running = {}  # name -> job id
+        now = time.time()
+        for name, (script, default_argv, default) in jobs.items():
+            env_name = name.upper().replace("-", "_")
+            interval = parse_interval(os.getenv(f"SYNC_SCHEDULE_{env_name}", default))
+            if interval is None:
+                print(f"⏸️ '{name}' is disabled.")
+                continue
+            argv = os.getenv(f"SYNC_ARGS_{env_name}")
+            argv = default_argv if argv is None else shlex.split(argv)
+            self.intervals[name] = (script, argv, interval)
+            last_started = self.state.get(name, {}).get("last_started")
+            self.next_runs[name] = next_run_time(last_started, interval, now)
+            print(f"🕒 '{name}' ({' '.join([script, *argv])}) every {interval:.0f}s, "
+                  f"next run in {self.next_runs[name] - now:.0f}s.")
+
+    def start_due_jobs(self, now):
+        for name, (script, argv, interval) in self.intervals.items():
+            if name in self.running or now < self.next_runs[name]:
+                continue
+            self.running[name] = self.runner.submit(name, script, argv)
+            self.state.setdefault(name, {})["last_started"] = now
+            self.next_runs[name] = next_run_time(now, interval, now)
+            save_state(self.state)
+            print(f"🚀 Started '{name}' (job {self.running[name]}).")
+
+    def collect_finished_jobs(self):
+        for name, job_id in list(self.running.items()):
+            job = self.runner.get(job_id)
+            if job and not job.done:
+                continue
+            del self.running[name]
+            if job is None:
+                continue
+            self.state[name].update({
+                "last_finished": job.finished_at, "last_status": job.status, "last_duration": job.duration
+            })
+            if job.status == "skipped":
+                # The script was busy (e.g. the full agents sync during an incremental slot); retry soon
+                self.next_runs[name] = next_run_time(None, 0, time.time())
+            save_state(self.state)
+            icon = {"succeeded": "✅", "skipped": "⏭️"}.get(job.status, "❌")
+            print(f"{icon} '{name}' {job.status} in {job.duration}s.")
+            for line in job.lines:
+                print(f"   [{name}] {line}")
+
+    def run_forever(self):
+        print("✅ Scheduler started.")
+        try:
+            while True:
+                self.collect_finished_jobs()
+                self.start_due_jobs(time.time())
+                time.sleep(TICK_SECONDS)
+        except KeyboardInterrupt:
+            print("🛑 Scheduler stopping.")
+
+def main():
+    # Treat SIGTERM (service stop) like Ctrl+C; locks of runs cut short are broken by the next run (dead PID)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    Scheduler().run_forever()
+
+if __name__ == "__main__":
+    # Ensure UTF-8 output (fixes UnicodeEncodeError on Windows)
+    sys.stdout = codecs.getwriter("utf-8")(sys.stdout.buffer, 'strict')
+    main()
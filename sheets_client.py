@@ -0,0 +1,159 @@
+import os
+import time
+import random
+import threading
+from googleapiclient.errors import HttpError
+
+# ---------------------------
+# Quota-aware execution of Google Sheets API requests
+# ---------------------------
+# Every Sheets call in the sync scripts goes through execute(). Read and write
+# requests each draw from a process-wide token bucket sized to the per-minute
+# quota, so concurrent jobs share the budget instead of tripping over it.
+# On 429 / 5xx / connection errors a request is retried, waiting for Retry-After
+# when the API sends it and backing off exponentially otherwise. A 429 also
+# halves the bucket's rate, which then creeps back up as requests succeed.
+#
+# Only idempotent requests (reads and values get/update/batchUpdate/clear) are
+# retried after a 5xx or connection error, since the first attempt may already
+# have been applied. spreadsheets().batchUpdate (addSheet, deleteDimension, ...)
+# and values().append are only retried on 429, which is rejected before it runs;
+# their callers re-read the sheet instead.
+
+READ_REQUESTS_PER_MINUTE  = float(os.getenv("SHEETS_READ_REQUESTS_PER_MINUTE", "60"))
+WRITE_REQUESTS_PER_MINUTE = float(os.getenv("SHEETS_WRITE_REQUESTS_PER_MINUTE", "60"))
+MAX_RETRIES               = int(os.getenv("SHEETS_MAX_RETRIES", "6"))
+MAX_BACKOFF_SECONDS       = 64
+
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+PAYLOAD_TOO_LARGE  = 413
+
+class TokenBucket:
+    """Thread-safe token bucket refilled at `rate_per_minute`, with AIMD rate adjustment."""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.max_rate = rate_per_minute / 60.0
+        self.rate = self.max_rate
+        self.capacity = capacity or max(1.0, rate_per_minute / 6)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait_time = (1 - self.tokens) / self.rate
+            time.sleep(max(wait_time, 0.01))
+
+    def throttle(self):
+        """Halve the rate after a quota error (never below one request per minute)."""
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = max(self.rate / 2, 1 / 60.0)
+            self.tokens = min(self.tokens, 0)
+
+    def recover(self):
+        """Grow the rate back towards the configured quota after a success."""
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+read_bucket = TokenBucket(READ_REQUESTS_PER_MINUTE)
+write_bucket = TokenBucket(WRITE_REQUESTS_PER_MINUTE)
+
+def retry_after_seconds(error):
+    """Retry-After header of an HttpError in seconds, or None."""
+    value = getattr(error, "resp", None) and error.resp.get("retry-after")
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+def is_payload_too_large(error):
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == PAYLOAD_TOO_LARGE:
+        return True
+    return error.resp.status == 400 and "payload size" in str(error).lower()
+
+def is_idempotent(request):
+    """True for requests that can safely be sent twice: reads and values writes to fixed ranges."""
+    if getattr(request, "method", "GET") == "GET":
+        return True
+    uri = getattr(request, "uri", "").split("?", 1)[0]
+    return "/values" in uri and not uri.endswith(":append")
+
+def execute(request, max_retries=MAX_RETRIES, idempotent=None):
+    """
+    Run a googleapiclient request under the shared quota, retrying transient failures.
+    Non-idempotent requests (see is_idempotent, or idempotent=False) are only retried on 429.
+    """
+    bucket = read_bucket if getattr(request, "method", "GET") == "GET" else write_bucket
+    if idempotent is None:
+        idempotent = is_idempotent(request)
+    for attempt in range(1, max_retries + 1):
+        bucket.acquire()
+        try:
+            response = request.execute()
+            bucket.recover()
+            return response
+        except HttpError as e:
+            status = e.resp.status
+            if status not in RETRYABLE_STATUSES or attempt == max_retries:
+                raise
+            if status != 429 and not idempotent:
+                raise
+            if status == 429:
+                bucket.throttle()
+            reason = f"HTTP {status}"
+            retry_after = retry_after_seconds(e)
+        except (TimeoutError, ConnectionError) as e:
+            if attempt == max_retries or not idempotent:
+                raise
+            reason = e.__class__.__name__
+            retry_after = None
+        backoff = min(MAX_BACKOFF_SECONDS, 2 ** attempt) + random.uniform(0, 1)
+        wait_time = max(retry_after or 0, backoff)
+        print(f"⚠️ Sheets request failed ({reason}). Retrying in {wait_time:.2f} seconds... (Attempt {attempt}/{max_retries})")
+        time.sleep(wait_time)
+
+def batch_update_values(service, spreadsheet_id, data, value_input_option="RAW"):
+    """values().batchUpdate that splits `data` in half whenever the payload is rejected as too large."""
+    if not data:
+        return
+    try:
+        execute(service.spreadsheets().values().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"valueInputOption": value_input_option, "data": data}
+        ))
+    except HttpError as e:
+        if not is_payload_too_large(e) or (len(data) == 1 and len(data[0]["values"]) == 1):
+            raise
+        if len(data) == 1:
+            data = split_value_range(data[0])
+        middle = len(data) // 2
+        print(f"⚠️ Payload too large, splitting {len(data)} ranges into two requests.")
+        batch_update_values(service, spreadsheet_id, data[:middle], value_input_option)
+        batch_update_values(service, spreadsheet_id, data[middle:], value_input_option)
+
+def split_value_range(value_range):
+    """Split one {"range": "'Sheet'!A5[:Z9]", "values": rows} update into two by rows."""
+    sheet_range, cells = value_range["range"].rsplit("!", 1)
+    start = cells.split(":")[0]
+    column = start.rstrip("0123456789")
+    first_row = int(start[len(column):])
+    rows = value_range["values"]
+    middle = len(rows) // 2
+    return [
+        {"range": f"{sheet_range}!{column}{first_row}", "values": rows[:middle]},
+        {"range": f"{sheet_range}!{column}{first_row + middle}", "values": rows[middle:]},
+    ]
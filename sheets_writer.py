@@ -0,0 +1,330 @@
+import os
+import math
+from concurrent.futures import ThreadPoolExecutor
+from googleapiclient.errors import HttpError
+from sheets_client import execute, batch_update_values
+
+# ---------------------------
+# Diff-based Google Sheets writer shared by the sync scripts
+# ---------------------------
+# Instead of clearing the sheet and rewriting every cell, the current sheet is read
+# once, rows are matched on a key column, and only changed or new rows are sent in
+# values().batchUpdate requests of about SHEETS_MAX_REQUEST_BYTES each (rows going to
+# consecutive sheet rows share one range). The next request is built while the
+# previous one is in flight. Rows whose key disappeared are deleted afterwards.
+
+MAX_REQUEST_BYTES = int(os.getenv("SHEETS_MAX_REQUEST_BYTES", str(2 * 1024 * 1024)))
+RANGE_OVERHEAD_BYTES = 64
+
+def column_letter(index):
+    """1-based column index -> A1 column letters (1 -> A, 27 -> AA)."""
+    letters = ""
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def quote_sheet_title(title):
+    return "'" + title.replace("'", "''") + "'"
+
+def normalize_number(value):
+    if isinstance(value, float):
+        if math.isnan(value) or math.isinf(value):
+            return ""
+        if value.is_integer():
+            return str(int(value))
+    return str(value)
+
+def normalize_cell(value, user_entered=False):
+    """
+    Render a value the way an UNFORMATTED_VALUE read returns it, so old and new rows
+    compare equal. With user_entered, strings are taken the way Sheets parses typed
+    input: numeric text becomes a number, true/false a boolean, and a leading
+    apostrophe marks plain text.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, (int, float)):
+        return normalize_number(value)
+    value = str(value)
+    if user_entered:
+        if value.startswith("'"):
+            return value[1:]
+        if value.strip().upper() in ("TRUE", "FALSE"):
+            return value.strip().upper()
+        try:
+            number = float(value)
+        except ValueError:
+            return value
+        if math.isfinite(number) and "_" not in value:
+            return normalize_number(number)
+    return value
+
+def normalize_row(row, width, user_entered=False):
+    cells = [normalize_cell(cell, user_entered) for cell in row[:width]]
+    return cells + [""] * (width - len(cells))
+
+def find_sheet(service, spreadsheet_id, sheet_name=None):
+    """(sheetId, title) of the named sheet (None means the first sheet), or None if it doesn't exist."""
+    metadata = execute(service.spreadsheets().get(
+        spreadsheetId=spreadsheet_id, fields="sheets.properties(sheetId,title)"
+    ))
+    sheets = [sheet["properties"] for sheet in metadata.get("sheets", [])]
+    if sheet_name is None and sheets:
+        return sheets[0]["sheetId"], sheets[0]["title"]
+    for properties in sheets:
+        if properties["title"] == sheet_name:
+            return properties["sheetId"], properties["title"]
+    return None
+
+def get_sheet_properties(service, spreadsheet_id, sheet_name=None):
+    """Return (sheetId, title) of the named sheet, creating it if missing. None means the first sheet."""
+    found = find_sheet(service, spreadsheet_id, sheet_name)
+    if found:
+        return found
+
+    try:
+        response = execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id,
+            body={"requests": [{"addSheet": {"properties": {"title": sheet_name}}}]}
+        ))
+    except (HttpError, TimeoutError, ConnectionError):
+        # addSheet isn't retried blindly: the failed attempt may have created the sheet
+        found = find_sheet(service, spreadsheet_id, sheet_name)
+        if found:
+            return found
+        raise
+    properties = response["replies"][0]["addSheet"]["properties"]
+    print(f"✅ New sheet '{sheet_name}' created.")
+    return properties["sheetId"], properties["title"]
+
+def estimate_bytes(row):
+    """Rough JSON size of a row: each cell plus quotes and a comma."""
+    return sum(len(str(cell)) + 3 for cell in row) + 2
+
+def pack_rows(sheet_range, numbered_rows, max_bytes=MAX_REQUEST_BYTES):
+    """
+    Group (row_number, row) pairs into lists of {"range", "values"} updates, each list
+    about `max_bytes` when serialized. Rows landing on consecutive sheet rows are
+    merged into one range.
+    """
+    batch, size, next_row = [], 0, None
+    for row_number, row in numbered_rows:
+        row_bytes = estimate_bytes(row)
+        if batch and size + row_bytes > max_bytes:
+            yield batch
+            batch, size, next_row = [], 0, None
+        if row_number == next_row:
+            batch[-1]["values"].append(row)
+        else:
+            batch.append({"range": f"{sheet_range}!A{row_number}", "values": [row]})
+            size += RANGE_OVERHEAD_BYTES
+        size += row_bytes
+        next_row = row_number + 1
+    if batch:
+        yield batch
+
+def send_batches(service, spreadsheet_id, batches, value_input_option="RAW"):
+    """Send each batch with values().batchUpdate while the next one is being built."""
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="sheets-writer") as executor:
+        in_flight = None
+        for batch in batches:
+            if in_flight:
+                in_flight.result()
+            in_flight = executor.submit(batch_update_values, service, spreadsheet_id, batch, value_input_option)
+        if in_flight:
+            in_flight.result()
+
+def rewrite_sheet(service, spreadsheet_id, title, headers, rows, existing, value_input_option="RAW"):
+    """Overwrite the sheet top-down in sized chunks, then clear whatever is left below and to the right."""
+    sheet_range = quote_sheet_title(title)
+    values_api = service.spreadsheets().values()
+
+    written = 0
+
+    def numbered_rows():
+        nonlocal written
+        yield 1, list(headers)
+        written = 1
+        for row in rows:
+            written += 1
+            yield written, list(row)
+
+    send_batches(service, spreadsheet_id, pack_rows(sheet_range, numbered_rows()), value_input_option)
+
+    leftovers = []
+    if len(existing) > written:
+        leftovers.append(f"{sheet_range}!{written + 1}:{len(existing)}")
+    old_width = max((len(row) for row in existing), default=0)
+    if old_width > len(headers):
+        leftovers.append(f"{sheet_range}!{column_letter(len(headers) + 1)}:{column_letter(old_width)}")
+    if leftovers:
+        execute(values_api.batchClear(spreadsheetId=spreadsheet_id, body={"ranges": leftovers}))
+
+    print(f"✅ Rewrote sheet '{title}' with {written - 1} rows.")
+    return {"updated": written - 1, "appended": 0, "deleted": max(len(existing) - written, 0)}
+
+def delete_requests(sheet_id, row_numbers):
+    """deleteDimension requests for 1-based row numbers, bottom-up and merged, so earlier deletions don't shift later ones."""
+    requests = []
+    for row_number in sorted(row_numbers, reverse=True):
+        if requests and requests[-1]["deleteDimension"]["range"]["startIndex"] == row_number:
+            requests[-1]["deleteDimension"]["range"]["startIndex"] = row_number - 1
+            continue
+        requests.append({"deleteDimension": {"range": {
+            "sheetId": sheet_id, "dimension": "ROWS",
+            "startIndex": row_number - 1, "endIndex": row_number
+        }}})
+    return requests
+
+def write_rows_in_order(service, spreadsheet_id, sheet_id, title, headers, rows, existing,
+                        existing_rows, unmatched_rows, key_index, value_input_option):
+    """
+    Diff-write `rows` so the sheet ends up in exactly their order: missing rows are
+    deleted and blank rows inserted where new keys go, then changed and new rows are
+    written in place. If the rows already in the sheet are in a different relative
+    order (or keys are blank or repeated), the sheet is rewritten instead.
+    """
+    sheet_range = quote_sheet_title(title)
+    width = len(headers)
+    user_entered = value_input_option == "USER_ENTERED"
+    rows = [list(row) for row in rows]
+    keys = [normalize_cell(row[key_index], user_entered) if len(row) > key_index else "" for row in rows]
+
+    wanted = set(keys)
+    if "" in keys or len(set(keys)) != len(keys):
+        print(f"⚠️ Blank or repeated keys, rewriting sheet '{title}' to keep the row order.")
+        return rewrite_sheet(service, spreadsheet_id, title, headers, rows, existing, value_input_option)
+    kept = sorted((row_number, key) for key, (row_number, _) in existing_rows.items() if key in wanted)
+    if [key for _, key in kept] != [key for key in keys if key in existing_rows]:
+        print(f"🔍 Row order of sheet '{title}' changed, rewriting it.")
+        return rewrite_sheet(service, spreadsheet_id, title, headers, rows, existing, value_input_option)
+
+    deleted_rows = unmatched_rows + [
+        row_number for key, (row_number, _) in existing_rows.items() if key not in wanted
+    ]
+    requests = delete_requests(sheet_id, deleted_rows)
+    # Once the deletions are done the kept rows are in order; open up a gap wherever a run
+    # of new keys goes, top-down, so each insert lands at its final row
+    appended = 0
+    for index, key in enumerate(keys):
+        if key in existing_rows:
+            continue
+        appended += 1
+        last = requests[-1].get("insertDimension") if requests else None
+        if last and last["range"]["endIndex"] == index + 1:
+            last["range"]["endIndex"] += 1
+            continue
+        requests.append({"insertDimension": {"range": {
+            "sheetId": sheet_id, "dimension": "ROWS", "startIndex": index + 1, "endIndex": index + 2
+        }, "inheritFromBefore": index > 0}})
+    if requests:
+        # Not retried on 5xx, like the deletions in write_sheet_diff; a failure aborts the
+        # write before any values are sent and the next sync starts over
+        execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body={"requests": requests}
+        ))
+
+    changed = []
+    for index, (key, row) in enumerate(zip(keys, rows)):
+        match = existing_rows.get(key)
+        if match and match[1] == normalize_row(row, width, user_entered):
+            continue
+        changed.append((index + 2, row))
+    send_batches(service, spreadsheet_id, pack_rows(sheet_range, changed), value_input_option)
+
+    summary = {"updated": len(changed) - appended, "appended": appended, "deleted": len(deleted_rows)}
+    print(f"✅ Sheet '{title}': {summary['updated']} rows updated, "
+          f"{summary['appended']} inserted, {summary['deleted']} deleted (order kept).")
+    return summary
+
+def write_sheet_diff(service, spreadsheet_id, sheet_name, headers, rows, key_column,
+                     value_input_option="RAW", delete_missing=True, ordered=False):
+    """
+    Bring the sheet in line with `headers` + `rows`, sending only rows that changed.
+
+    Rows are matched on `key_column`. `rows` may be any iterable; only the current
+    sheet and about two requests' worth of changed rows are kept in memory, and rows
+    are read from `rows` while the previous request is in flight. With delete_missing=False the
+    call is an upsert: rows that are not in `rows` are left alone. New rows are appended
+    at the bottom unless ordered=True, which keeps the sheet in the order of `rows`
+    (see write_rows_in_order; `rows` is then held in memory).
+    Returns a dict with "updated", "appended" and "deleted" counts.
+    """
+    sheet_id, title = get_sheet_properties(service, spreadsheet_id, sheet_name)
+    sheet_range = quote_sheet_title(title)
+    values_api = service.spreadsheets().values()
+    # Read raw values rather than the display text, so number formats don't show up as
+    # changes; dates (written as text) are read back as their displayed string.
+    existing = execute(values_api.get(
+        spreadsheetId=spreadsheet_id, range=sheet_range,
+        valueRenderOption="UNFORMATTED_VALUE", dateTimeRenderOption="FORMATTED_STRING"
+    )).get("values", [])
+
+    width = len(headers)
+    key_index = list(headers).index(key_column)
+    user_entered = value_input_option == "USER_ENTERED"
+
+    header_width = max(width, len(existing[0])) if existing else width
+    if not existing or normalize_row(existing[0], header_width) != normalize_row(list(headers), header_width, user_entered):
+        if existing and not delete_missing:
+            raise ValueError(f"Header row of sheet '{title}' does not match; run a full sync first.")
+        return rewrite_sheet(service, spreadsheet_id, title, headers, rows, existing, value_input_option)
+
+    # key -> (1-based row number, normalized cells); blank and duplicate keys can't be matched
+    existing_rows = {}
+    unmatched_rows = []
+    for row_number, row in enumerate(existing[1:], start=2):
+        key = normalize_cell(row[key_index]) if len(row) > key_index else ""
+        if not key or key in existing_rows:
+            unmatched_rows.append(row_number)
+        else:
+            existing_rows[key] = (row_number, normalize_row(row, width))
+
+    if ordered and delete_missing:
+        return write_rows_in_order(service, spreadsheet_id, sheet_id, title, headers, rows, existing,
+                                   existing_rows, unmatched_rows, key_index, value_input_option)
+
+    updated = 0
+    appended = 0
+    seen = set()
+
+    def changed_rows():
+        nonlocal updated, appended
+        next_row = len(existing) + 1
+        for row in rows:
+            row = list(row)
+            key = normalize_cell(row[key_index], user_entered) if len(row) > key_index else ""
+            match = existing_rows.get(key) if key and key not in seen else None
+            seen.add(key)
+            if match:
+                row_number, old_cells = match
+                if old_cells == normalize_row(row, width, user_entered):
+                    continue
+                updated += 1
+            else:
+                row_number = next_row
+                next_row += 1
+                appended += 1
+            yield row_number, row
+
+    send_batches(service, spreadsheet_id, pack_rows(sheet_range, changed_rows()), value_input_option)
+
+    deleted_rows = []
+    if delete_missing:
+        deleted_rows = unmatched_rows + [
+            row_number for key, (row_number, _) in existing_rows.items() if key not in seen
+        ]
+    if deleted_rows:
+        # Not retried on 5xx: if the first attempt went through, the row numbers have shifted.
+        # A failure leaves the rows in place and the next sync deletes them.
+        execute(service.spreadsheets().batchUpdate(
+            spreadsheetId=spreadsheet_id, body={"requests": delete_requests(sheet_id, deleted_rows)}
+        ))
+
+    summary = {"updated": updated, "appended": appended, "deleted": len(deleted_rows)}
+    print(f"✅ Sheet '{title}': {summary['updated']} rows updated, "
+          f"{summary['appended']} appended, {summary['deleted']} deleted.")
+    return summary
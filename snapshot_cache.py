@@ -0,0 +1,211 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import datetime
+from firestore_reader import stream_collection, iter_collection_pages, PAGE_SIZE
+
+# ---------------------------
+# Local read-through cache of Firestore collections
+# ---------------------------
+# Each collection is kept in <FIRESTORE_CACHE_DIR>/<collection>.sqlite together with
+# every document's update time. A read only goes to Firestore for documents whose
+# modified field is at or past the cached high-water mark (documents sharing the
+# boundary value are read again and upserted by ID); everything else is served
+# from disk. Every FIRESTORE_CACHE_RECONCILE_MINUTES the document IDs are listed
+# to drop deleted documents, and once the cache is older than
+# FIRESTORE_CACHE_FULL_REFRESH_HOURS it is re-read in full.
+#
+# Staleness bound: a write that bumps the modified field shows up after at most
+# FIRESTORE_CACHE_TTL_SECONDS, a deletion after FIRESTORE_CACHE_RECONCILE_MINUTES,
+# and a write that doesn't bump the modified field after
+# FIRESTORE_CACHE_FULL_REFRESH_HOURS. Set FIRESTORE_CACHE=0 to always read live.
+#
+# The files are shared by the scheduler and the dashboard, so they use WAL mode
+# (reads never wait on a refresh) and a refresh takes the write lock up front:
+# a second process refreshing the same collection waits for the first and then
+# finds the cache fresh instead of reading Firestore again.
+#
+# Reads with a field projection are cached separately from full documents (one file
+# per collection and field set), since a projected document can't serve a full read.
+
+CACHE_DIR          = os.getenv("FIRESTORE_CACHE_DIR", ".firestore-cache")
+CACHE_ENABLED      = os.getenv("FIRESTORE_CACHE", "1") != "0"
+CACHE_TTL_SECONDS  = float(os.getenv("FIRESTORE_CACHE_TTL_SECONDS", "60"))
+FULL_REFRESH_HOURS = float(os.getenv("FIRESTORE_CACHE_FULL_REFRESH_HOURS", "6"))
+RECONCILE_MINUTES  = float(os.getenv("FIRESTORE_CACHE_RECONCILE_MINUTES", "15"))
+BUSY_TIMEOUT       = float(os.getenv("FIRESTORE_CACHE_BUSY_TIMEOUT_SECONDS", "600"))
+
+# Numeric field bumped on every write, per collection; collections without one
+# are re-read in full whenever the cache is stale.
+MODIFIED_FIELDS = {
+    "agents": "lastModified",
+    "enquiries": "lastModified",
+    "requirements": "lastModified",
+}
+
+class CachedSnapshot:
+    """Minimal stand-in for a DocumentSnapshot served from the cache."""
+
+    def __init__(self, doc_id, data, update_time):
+        self.id = doc_id
+        self.exists = True
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return json.loads(self._data)
+
+def _encode_value(value):
+    # Firestore timestamps, GeoPoints and references are not JSON types
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):
+        return {"lat": value.latitude, "lng": value.longitude}
+    if hasattr(value, "path"):
+        return value.path
+    return str(value)
+
+def _timestamp(value):
+    return value.timestamp() if hasattr(value, "timestamp") else None
+
+def _cache_name(collection_name, fields):
+    if not fields:
+        return collection_name
+    digest = hashlib.sha1("\n".join(sorted(fields)).encode("utf-8")).hexdigest()[:10]
+    return f"{collection_name}-{digest}"
+
+def _projection(fields, modified_field):
+    """Field mask to read, always including the modified field the delta query needs."""
+    if not fields:
+        return None
+    fields = list(dict.fromkeys(fields))
+    if modified_field and modified_field not in fields:
+        fields.append(modified_field)
+    return fields
+
+def _connect(cache_name):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    conn = sqlite3.connect(os.path.join(CACHE_DIR, f"{cache_name}.sqlite"), timeout=BUSY_TIMEOUT)
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS documents ("
+        "id TEXT PRIMARY KEY, data TEXT NOT NULL, update_time REAL, modified REAL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value REAL)")
+    return conn
+
+def _get_meta(conn, key):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def _set_meta(conn, key, value):
+    conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+def _store(conn, snapshots, modified_field):
+    """Upsert snapshots; returns (count, largest numeric modified value seen)."""
+    count = 0
+    high_water_mark = None
+    for snapshot in snapshots:
+        data = snapshot.to_dict() or {}
+        modified = data.get(modified_field) if modified_field else None
+        if not isinstance(modified, (int, float)) or isinstance(modified, bool):
+            modified = None
+        elif high_water_mark is None or modified > high_water_mark:
+            high_water_mark = modified
+        conn.execute(
+            "INSERT OR REPLACE INTO documents (id, data, update_time, modified) VALUES (?, ?, ?, ?)",
+            (snapshot.id, json.dumps(data, default=_encode_value, ensure_ascii=False),
+             _timestamp(snapshot.update_time), modified)
+        )
+        count += 1
+    return count, high_water_mark
+
+def _reconcile(conn, collection_ref):
+    """Drop cached documents that no longer exist in Firestore; only document IDs are read."""
+    live_ids = set()
+    for page in iter_collection_pages(collection_ref, fields=["__name__"]):
+        live_ids.update(snapshot.id for snapshot in page)
+    cached_ids = [row[0] for row in conn.execute("SELECT id FROM documents")]
+    deleted = [(doc_id,) for doc_id in cached_ids if doc_id not in live_ids]
+    conn.executemany("DELETE FROM documents WHERE id = ?", deleted)
+    return len(deleted)
+
+def refresh(collection_ref, modified_field=None, fields=None):
+    """Bring the cache for this collection (and field projection) up to date with Firestore."""
+    collection_name = collection_ref.id
+    modified_field = modified_field or MODIFIED_FIELDS.get(collection_name)
+    fields = _projection(fields, modified_field)
+    conn = _connect(_cache_name(collection_name, fields))
+    try:
+        # Take the write lock before looking at the meta, so concurrent refreshes queue up
+        conn.execute("BEGIN IMMEDIATE")
+        now = time.time()
+        refreshed_at = _get_meta(conn, "refreshed_at")
+        full_refresh_at = _get_meta(conn, "full_refresh_at")
+        reconciled_at = _get_meta(conn, "reconciled_at") or full_refresh_at
+        high_water_mark = _get_meta(conn, "high_water_mark")
+
+        if refreshed_at is not None and now - refreshed_at < CACHE_TTL_SECONDS:
+            print(f"✅ Cache for '{collection_name}' is fresh, skipping Firestore.")
+            conn.rollback()
+            return
+
+        full = (
+            full_refresh_at is None
+            or now - full_refresh_at > FULL_REFRESH_HOURS * 3600
+            or not modified_field
+            or high_water_mark is None
+        )
+        if full:
+            print(f"🔍 Refreshing cache for '{collection_name}' from a full read...")
+            conn.execute("DELETE FROM documents")
+            count, new_mark = _store(conn, stream_collection(collection_ref, fields=fields), modified_field)
+            _set_meta(conn, "full_refresh_at", now)
+            _set_meta(conn, "reconciled_at", now)
+        else:
+            print(f"🔍 Refreshing cache for '{collection_name}' with documents modified since {high_water_mark}...")
+            delta = collection_ref.where(modified_field, ">=", high_water_mark)
+            delta = (delta.select(fields) if fields else delta).stream()
+            count, new_mark = _store(conn, delta, modified_field)
+            if reconciled_at is None or now - reconciled_at > RECONCILE_MINUTES * 60:
+                deleted = _reconcile(conn, collection_ref)
+                _set_meta(conn, "reconciled_at", now)
+                print(f"✅ Dropped {deleted} deleted documents from the '{collection_name}' cache.")
+
+        if new_mark is not None and (high_water_mark is None or full or new_mark > high_water_mark):
+            _set_meta(conn, "high_water_mark", new_mark)
+        _set_meta(conn, "refreshed_at", now)
+        conn.commit()
+        print(f"✅ Cached {count} {'documents' if full else 'changed documents'} for '{collection_name}'.")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+def read_through_pages(collection_ref, page_size=PAGE_SIZE, modified_field=None, fields=None):
+    """Refresh the cache, then yield pages of cached snapshots (only `fields`, if given)."""
+    if not CACHE_ENABLED:
+        yield from iter_collection_pages(collection_ref, page_size=page_size, fields=fields)
+        return
+
+    refresh(collection_ref, modified_field, fields)
+    modified_field = modified_field or MODIFIED_FIELDS.get(collection_ref.id)
+    conn = _connect(_cache_name(collection_ref.id, _projection(fields, modified_field)))
+    try:
+        cursor = conn.execute("SELECT id, data, update_time FROM documents ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(page_size)
+            if not rows:
+                return
+            yield [CachedSnapshot(doc_id, data, update_time) for doc_id, data, update_time in rows]
+    finally:
+        conn.close()
+
+def read_through(collection_ref, modified_field=None, fields=None):
+    """Drop-in replacement for `collection_ref.stream()` served from the local cache."""
+    for page in read_through_pages(collection_ref, modified_field=modified_field, fields=fields):
+        yield from page
@@ -0,0 +1,118 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+# ---------------------------
+# Concurrent plan and credit writes against the Firestore emulator
+# ---------------------------
+# Start the emulator (`firebase emulators:start --only firestore`) and run with
+# FIRESTORE_EMULATOR_HOST=localhost:8080 python -m pytest tests/
+# Without FIRESTORE_EMULATOR_HOST the tests are skipped.
+
+pytestmark = pytest.mark.skipif(
+    not os.getenv("FIRESTORE_EMULATOR_HOST"), reason="needs the Firestore emulator (FIRESTORE_EMULATOR_HOST)"
+)
+
+WRITERS = 16
+UPDATES = 400
+
+@pytest.fixture
+def db():
+    from google.cloud import firestore
+    return firestore.Client(project=os.getenv("GCLOUD_PROJECT", "demo-test"))
+
+@pytest.fixture
+def agent(db):
+    agent_id = f"test-{uuid.uuid4().hex}"
+    ref = db.collection("agents").document(agent_id)
+    ref.set({"monthlyCredits": 5, "userType": "basic", "phonenumber": "+910000000000"})
+    yield {"id": agent_id, "phonenumber": "+910000000000"}
+    ref.delete()
+
+def credits(db, agent):
+    return db.collection("agents").document(agent["id"]).get().get("monthlyCredits")
+
+def run_concurrently(update, count):
+    with ThreadPoolExecutor(max_workers=WRITERS) as executor:
+        for future in [executor.submit(update, i) for i in range(count)]:
+            future.result()
+
+def test_concurrent_top_ups_lose_no_credits(db, agent):
+    from agent_plans import add_credits
+    run_concurrently(lambda i: add_credits(db, agent["id"], 1), UPDATES)
+    assert credits(db, agent) == 5 + UPDATES
+
+def test_concurrent_additions_and_removals_balance(db, agent):
+    from agent_plans import add_credits
+    # Alternate +3 / -2, as when credits are added and removed from the dashboard at once
+    run_concurrently(lambda i: add_credits(db, agent["id"], 3 if i % 2 else -2), UPDATES)
+    assert credits(db, agent) == 5 + (UPDATES // 2) * (3 - 2)
+
+def test_top_ups_racing_a_plan_change(db, agent):
+    from agent_plans import PLAN_CONFIGS, add_credits, update_plan
+    # The plan change resets credits to the plan's allowance, so top-ups that land
+    # before it are replaced; every top-up that lands after it must be kept
+    with ThreadPoolExecutor(max_workers=WRITERS) as executor:
+        racing = [executor.submit(add_credits, db, agent["id"], 1) for _ in range(UPDATES // 2)]
+        plan_change = executor.submit(update_plan, db, agent["id"], "premium")
+        for future in racing + [plan_change]:
+            future.result()
+    run_concurrently(lambda i: add_credits(db, agent["id"], 1), UPDATES // 2)
+
+    snapshot = db.collection("agents").document(agent["id"]).get()
+    allowance = PLAN_CONFIGS["premium"]["monthly_credits"]
+    assert allowance + UPDATES // 2 <= snapshot.get("monthlyCredits") <= allowance + UPDATES
+    assert snapshot.get("userType") == "premium"
+    # Read inside the transaction: the agent was still basic, so the trial is recorded
+    assert snapshot.get("trialUsed") is True
+
+class CommitTimesOut:
+    """Wraps a client so the first batch commit is applied but reported as DeadlineExceeded."""
+
+    def __init__(self, db):
+        self.db = db
+        self.timeouts = 1
+
+    def __getattr__(self, name):
+        return getattr(self.db, name)
+
+    def batch(self):
+        from google.api_core import exceptions as api_exceptions
+        batch = self.db.batch()
+        commit = batch.commit
+
+        def commit_then_time_out():
+            result = commit()
+            if self.timeouts:
+                self.timeouts -= 1
+                raise api_exceptions.DeadlineExceeded("commit response lost")
+            return result
+
+        batch.commit = commit_then_time_out
+        return batch
+
+def test_retried_credit_batch_is_not_applied_twice(db, agent, monkeypatch):
+    import firestore_writer
+    from agent_plans import build_bulk_changes, apply_bulk_changes
+    monkeypatch.setattr(firestore_writer.time, "sleep", lambda seconds: None)
+    changes = build_bulk_changes({agent["id"]: agent}, credits_delta=10)
+
+    committed, failed = apply_bulk_changes(CommitTimesOut(db), changes)
+
+    # The commit landed but its response was lost: reported as failed, applied exactly once
+    assert (committed, failed) == (0, 1)
+    assert credits(db, agent) == 5 + 10
+
+def test_idempotent_batch_is_retried_after_a_lost_response(db, agent, monkeypatch):
+    import firestore_writer
+    from firestore_writer import commit_in_batches
+    monkeypatch.setattr(firestore_writer.time, "sleep", lambda seconds: None)
+    ref = db.collection("agents").document(agent["id"])
+
+    # A plain set is idempotent, so the default path retries it after the lost response
+    committed, failed = commit_in_batches(CommitTimesOut(db), [("update", ref, {"monthlyCredits": 100})])
+
+    assert (committed, failed) == (1, 0)
+    assert credits(db, agent) == 100
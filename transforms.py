@@ -0,0 +1,120 @@
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+# ---------------------------
+# Columnar row transforms shared by the sync scripts
+# ---------------------------
+# Documents are loaded into one frame per page, and date formatting, list joining,
+# NaN scrubbing and column ordering run once per column instead of once per cell.
+# Columns Arrow can type are kept Arrow-backed (ArrowDtype), so int columns with gaps
+# stay int64 instead of turning into float64 and printing as "1.0". Columns Arrow
+# can't type (mixed types, ints beyond int64, GeoPoints, ...) fall back to object.
+
+def _column(values):
+    """An Arrow-backed series if Arrow can type `values`, else an object series."""
+    try:
+        return pd.Series(pd.arrays.ArrowExtensionArray(pa.array(values)))
+    except (pa.ArrowException, OverflowError, TypeError):
+        return pd.Series(values, dtype=object)
+
+def records_to_frame(records, fields):
+    """One frame with exactly `fields` as columns; missing fields are null."""
+    fields = list(dict.fromkeys(fields))
+    records = list(records)
+    try:
+        # Field names and types are inferred across all records in one pass in C++
+        struct = pa.array(records) if records else None
+    except (pa.ArrowException, OverflowError, TypeError):
+        struct = None
+    if struct is not None and pa.types.is_struct(struct.type):
+        arrays = dict(zip([field.name for field in struct.type], struct.flatten()))
+        columns = {
+            field: pd.Series(pd.arrays.ArrowExtensionArray(
+                arrays.get(field, pa.nulls(len(records)))
+            ))
+            for field in fields
+        }
+    else:
+        # Some field couldn't be typed: build the columns one at a time
+        columns = {field: _column([record.get(field) for record in records]) for field in fields}
+    return pd.DataFrame(columns, columns=fields)
+
+def _arrow(series):
+    """The series as an Arrow array if it is Arrow-backed, else None."""
+    if isinstance(series.dtype, pd.ArrowDtype):
+        return pa.array(series)
+    return None
+
+def _series(array, index):
+    return pd.Series(pd.arrays.ArrowExtensionArray(array), index=index)
+
+def format_unix_dates(series, date_format):
+    """Unix seconds (int, float or numeric string) -> formatted UTC date; empty/invalid -> ""."""
+    array = _arrow(series)
+    if array is not None and (pa.types.is_integer(array.type) or pa.types.is_floating(array.type)):
+        seconds = pd.Series(pc.cast(array, pa.float64()).to_numpy(zero_copy_only=False), index=series.index)
+    else:
+        seconds = pd.to_numeric(series.astype(object), errors="coerce")
+    seconds = seconds.where(seconds != 0)
+    dates = pd.to_datetime(seconds, unit="s", utc=True, errors="coerce")
+    return dates.dt.strftime(date_format).fillna("").astype(object)
+
+def join_lists(series, separator=", "):
+    """Join list cells into one string; non-list cells are left as they are."""
+    try:
+        array = pa.array(series, from_pandas=True)
+        if not pa.types.is_list(array.type):
+            # No lists in this column at all
+            return series
+        joined = pc.binary_join(array.cast(pa.list_(pa.string())), separator)
+        return pd.Series(joined.to_pandas(), index=series.index, dtype=object)
+    except pa.ArrowException:
+        pass
+    # Mixed column: join only the list cells
+    is_list = series.map(type) == list
+    joined = series[is_list].map(lambda values: separator.join(str(v) for v in values))
+    return series.where(~is_list, joined)
+
+def is_dict(series):
+    """True where the cell is a map (an Arrow struct or a dict)."""
+    array = _arrow(series)
+    if array is not None:
+        return series.notna() if pa.types.is_struct(array.type) else pd.Series(False, index=series.index)
+    return series.map(type) == dict
+
+def dict_field(series, key):
+    """Pull `key` out of dict cells; non-dict cells give null."""
+    array = _arrow(series)
+    if array is not None:
+        if pa.types.is_struct(array.type) and array.type.get_field_index(key) >= 0:
+            return _series(pc.struct_field(array, key), series.index)
+        return _series(pa.nulls(len(series)), series.index)
+    # Object column (mixed cell types)
+    mask = is_dict(series)
+    values = pd.Series(None, index=series.index, dtype=object)
+    values[mask] = [cell.get(key) for cell in series[mask]]
+    return values
+
+def to_text(series):
+    """None/NaN -> "" and every other cell -> str."""
+    array = _arrow(series)
+    if array is not None:
+        if pa.types.is_floating(array.type):
+            array = pc.if_else(pc.is_nan(array), pa.scalar(None, array.type), array)
+        if pa.types.is_boolean(array.type):
+            text = pc.if_else(array, "True", "False")
+        elif (pa.types.is_integer(array.type) or pa.types.is_floating(array.type)
+              or pa.types.is_string(array.type) or pa.types.is_large_string(array.type)
+              or pa.types.is_null(array.type)):
+            # Ints print exactly ("1", never "1.0"); whole floats print like ints too
+            text = pc.cast(array, pa.string())
+        else:
+            # Timestamps, lists and maps print the way str() shows the Python value
+            text = pa.array([None if value is None else str(value) for value in array.to_pylist()], pa.string())
+        return pd.Series(pc.fill_null(text, "").to_numpy(zero_copy_only=False), index=series.index, dtype=object)
+    return series.astype(object).where(series.notna(), "").astype(str)
+
+def scrub(frame):
+    """None/NaN -> "" and every other cell -> str, column by column."""
+    return frame.apply(to_text)